@@ -0,0 +1,179 @@
+"""Time each stage of the pipeline on the bundled and synthetic pages."""
+
+# pylint: disable=invalid-name
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import statistics
+import tempfile
+from time import perf_counter
+
+import numpy as np
+import skimage
+from skimage import io
+
+from boyd_journal_extraction import (
+    build_month_graphs, get_left_side, get_month_graph_areas, init_csv_file,
+    output_results)
+from lib.grid import Grid
+from lib.pages import page_id
+from lib.synthetic import render_page
+
+ASSET = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    'assets', 'Boyd_M_Bird_journal_section1-024.png')
+
+STAGES = ['load', 'get_left_side', 'get_month_graph_areas',
+          'build_month_graphs', 'get_slashes', 'output_results']
+
+
+def time_stages(file_name, out_dir):
+    """Run the pipeline on one page and time each stage."""
+    times = {}
+    csv_path = os.path.join(out_dir, 'benchmark.csv')
+    init_csv_file(csv_path)
+
+    start = perf_counter()
+    grid = Grid(file_name=file_name)
+    times['load'] = perf_counter() - start
+
+    start = perf_counter()
+    left_side = get_left_side(grid)
+    times['get_left_side'] = perf_counter() - start
+
+    start = perf_counter()
+    months = get_month_graph_areas(grid, left_side)
+    times['get_month_graph_areas'] = perf_counter() - start
+
+    start = perf_counter()
+    build_month_graphs(months)
+    times['build_month_graphs'] = perf_counter() - start
+
+    start = perf_counter()
+    for month in months:
+        month.get_slashes()
+    times['get_slashes'] = perf_counter() - start
+
+    start = perf_counter()
+    output_results(page_id(file_name), csv_path, grid, months, left_side,
+                   image_dir=out_dir)
+    times['output_results'] = perf_counter() - start
+
+    info = {
+        'height': grid.height,
+        'width': grid.width,
+        'ink_density': grid.ink_density,
+        'months_found': len(months),
+    }
+    return times, info
+
+
+def benchmark_page(file_name, params, repeat, out_dir):
+    """Time a page several times and keep the median time of each stage."""
+    result = {'page': os.path.basename(file_name), 'params': params}
+    runs = []
+    try:
+        for _ in range(repeat):
+            times, info = time_stages(file_name, out_dir)
+            runs.append(times)
+    except Exception as err:  # pylint: disable=broad-except
+        result['error'] = f'{type(err).__name__}: {err}'
+        return result
+
+    result.update(info)
+    result['stages'] = {
+        s: statistics.median(r[s] for r in runs) for s in STAGES}
+    result['total'] = sum(result['stages'].values())
+    return result
+
+
+def synthetic_params(args):
+    """Get every combination of the synthetic page parameters."""
+    for scale, skew, months, density in itertools.product(
+            args.scales, args.skews, args.months, args.densities):
+        yield {'scale': scale, 'skew': skew, 'months': months,
+               'rows': args.rows, 'density': density, 'seed': args.seed}
+
+
+def run_benchmarks(args):
+    """Run the benchmarks and return the results."""
+    results = []
+    with tempfile.TemporaryDirectory() as out_dir:
+        if not args.no_asset:
+            results.append(benchmark_page(
+                ASSET, {'asset': True}, args.repeat, out_dir))
+            print_result(results[-1])
+
+        for params in synthetic_params(args):
+            page, _ = render_page(**params)
+            name = 'synthetic_{scale}_{skew}_{months}_{density}'.format(
+                **params)
+            file_name = os.path.join(out_dir, name + '.png')
+            io.imsave(file_name, page.astype(np.uint8) * 255,
+                      check_contrast=False)
+            results.append(benchmark_page(
+                file_name, params, args.repeat, out_dir))
+            print_result(results[-1])
+
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'skimage': skimage.__version__,
+        'machine': platform.machine(),
+        'repeat': args.repeat,
+        'results': results,
+    }
+
+
+def print_result(result):
+    """Print a one line summary of a benchmark result."""
+    if 'error' in result:
+        print(f"{result['page']}: {result['error']}")
+    else:
+        print(f"{result['page']}: {result['total']:.3f}s")
+
+
+def parse_args():
+    """Process command-line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--json', default='benchmark.json',
+        help="""Write the results to this JSON file.
+            (default: %(default)s)""")
+    parser.add_argument(
+        '--repeat', type=int, default=3,
+        help="""Time each page this many times. (default: %(default)s)""")
+    parser.add_argument(
+        '--no-asset', action='store_true',
+        help="""Skip the bundled journal page.""")
+    parser.add_argument(
+        '--scales', type=float, nargs='*', default=[1.0],
+        help="""Synthetic page scale factors. (default: %(default)s)""")
+    parser.add_argument(
+        '--skews', type=float, nargs='*', default=[0.0],
+        help="""Synthetic page skew angles in degrees.
+            (default: %(default)s)""")
+    parser.add_argument(
+        '--months', type=int, nargs='*', default=[3],
+        help="""Synthetic page month counts. (default: %(default)s)""")
+    parser.add_argument(
+        '--densities', type=float, nargs='*', default=[0.3],
+        help="""Synthetic page slash densities. (default: %(default)s)""")
+    parser.add_argument(
+        '--rows', type=int, default=28,
+        help="""Rows per month on the synthetic pages.
+            (default: %(default)s)""")
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help="""Random seed for the synthetic pages. (default: %(default)s)""")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    ARGS = parse_args()
+    RESULTS = run_benchmarks(ARGS)
+    with open(ARGS.json, 'w') as json_file:
+        json.dump(RESULTS, json_file, indent=2)
@@ -2,24 +2,40 @@
 
 # pylint: disable=no-member, invalid-name
 
+import argparse
 import csv
 import glob
+import json
 import os
+import shutil
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from functools import partial
 
-import matplotlib.pyplot as plt
-from matplotlib import patches
+import numpy as np
 
-from lib.cell import Cell
+from skimage import io
+
+from lib import instrument, layout_prior, threads
+from lib.daemon import Daemon, DirectoryWatcher, SocketListener
+from lib.database import ObservationDatabase
+from lib.geometry_cache import GeometryCache
 from lib.grid import Grid
-from lib.util import Crop, extend_line, intersection
+from lib.grid_lines import GridLines
+from lib.manifest import Manifest, content_hash, fingerprint
+from lib.observations import CSV_HEADER, DAYS, ObservationStore, csv_row
+from lib.pages import image_file_pages, page_id, pdf_pages
+from lib.pipeline import Pipeline
+from lib.qc import QCImage
+from lib.util import Crop, PageResult, extend_lines, intersections
 
 
-def get_left_side(grid):
+def get_left_side(grid, prior=None):
     """Get the left side of the grid."""
     right = int(grid.width / 2)
     left_side = Grid(
         grid=grid, crop=Crop(left=0, right=right, top=0, bottom=0))
-    left_side.find_grid_lines()
+    left_side.find_grid_lines(prior)
     left_side.vert_insert_line(0, distance=-80)
     left_side.get_cells()
     left_side.get_row_labels()
@@ -28,22 +44,18 @@ def get_left_side(grid):
 
 def crop_rows(grid, top_line, bottom_line):
     """Get the exterior image of all the rows."""
-    top_line = extend_line(top_line, grid.width)
-    bottom_line = extend_line(bottom_line, grid.width)
+    rows = extend_lines([top_line, bottom_line], grid.width)
 
     left = int(grid.width / 2) - 200
     left_line = ([left, 0], [left, grid.height])
 
     right_line = ([grid.width, 0], [grid.width, grid.height])
 
-    top_left = intersection(top_line, left_line)
-    top_right = intersection(top_line, right_line)
-    bottom_left = intersection(bottom_line, left_line)
-    bottom_right = intersection(bottom_line, right_line)
+    x, y = intersections(rows, [left_line, right_line])
 
-    top = min(top_left.y, top_right.y) - 20
-    bottom = grid.height - max(bottom_left.y, bottom_right.y) + 40
-    left = max(top_left.x, bottom_left.x)
+    top = int(y[0].min()) - 20
+    bottom = grid.height - int(y[1].max()) + 40
+    left = int(x[:, 0].max())
 
     return Grid(grid=grid, split=True,
                 crop=Crop(top=top, bottom=bottom, left=left, right=0))
@@ -79,118 +91,646 @@ def get_month_graph_areas(grid, left_side):
     return months
 
 
-def build_month_graphs(months):
-    """Find the grid for each month."""
-    for month in months:
-        month.find_grid_lines()
+def build_month_graph(month, prior=None):
+    """Find the grid for a month."""
+    month.find_grid_lines(prior)
+
+    # Insert left edge of the graph
+    month.vert_insert_line(0, distance=-60)
+
+    # Insert right edge of the graph
+    right_edge = ([month.width, 0], [month.width, month.height])
+    month.vert_add_line(right_edge[0], right_edge[1])
+
+    month.get_cells()
+    month.get_col_labels()
+
+
+def build_month_graphs(months, priors=None):
+    """Find the grid for each month. The months are independent."""
+    priors = priors or [None] * len(months)
+    threads.map_ordered(lambda mp: build_month_graph(*mp),
+                        zip(months, priors))
+
+
+def find_geometry(grid, cache=None):
+    """Find the left side and month grids, or reuse them from the cache."""
+    if cache:
+        with instrument.stage('geometry_cache'):
+            key = cache.key(grid.edges)
+            left_side, months = cache.get_geometry(key, grid)
+            if left_side:
+                left_side.get_cells()
+                for month in months:
+                    month.get_cells()
+        if left_side:
+            return left_side, months
+
+    # The previous page's lines, if we are using them, are only used for the
+    # months when the pages have the same number of months
+    prior = layout_prior.PRIOR.get(grid.edges)
+
+    with instrument.stage('get_left_side'):
+        left_side = get_left_side(grid, prior and prior['left_side'])
+
+    with instrument.stage('get_month_graph_areas'):
+        months = get_month_graph_areas(grid, left_side)
 
-        # Insert left edge of the graph
-        month.vert_insert_line(0, distance=-60)
+    month_priors = None
+    if prior and len(prior['months']) == len(months):
+        month_priors = prior['months']
+
+    with instrument.stage('build_month_graphs'):
+        build_month_graphs(months, month_priors)
+
+    layout_prior.PRIOR.remember(grid, left_side, months)
+
+    if cache:
+        cache.put_geometry(key, left_side, months)
+
+    return left_side, months
+
+
+def day_matrix(month):
+    """Get which days have a slash for each row of the month image."""
+    days = np.zeros((len(month.slashes), DAYS), dtype=bool)
+    cols = [col for col, label in enumerate(month.col_labels)
+            if label and col < month.slashes.shape[1]]
+    days[:, :len(cols)] = month.slashes[:, cols]
+    return days
+
+
+def csv_rows(base_name, months):
+    """Get the CSV rows for the day matrices of all the month images."""
+    return [csv_row(base_name, chart, row_no, row_days)
+            for chart, days in enumerate(months, 1)
+            for row_no, row_days in enumerate(days, 1)]
+
+
+def write_csv(csv_path, base_name, months):
+    """Append the rows for all of the month images to the CSV file."""
+    with open(csv_path, 'a', newline='') as csv_file:
+        csv.writer(csv_file).writerows(csv_rows(base_name, months))
 
-        # Insert right edge of the graph
-        right_edge = ([month.width, 0], [month.width, month.height])
-        month.vert_add_line(right_edge[0], right_edge[1])
 
-        month.get_cells()
-        month.get_col_labels()
+def write_observations(csv_path, base_name, months, store=None):
+    """Write the day matrices to the observation store or the CSV file."""
+    if store:
+        store.append(base_name, months)
+    else:
+        write_csv(csv_path, base_name, months)
 
 
-def color_row_labels(left_side, ax):
-    """Color the row labels in the given image."""
-    for row_idx, row in enumerate(left_side.cells):
-        if left_side.row_labels[row_idx]:
-            top_left, width, height = row[0].get_patch()
-            ax.add_patch(patches.Rectangle(
-                top_left, width, height, alpha=0.5, facecolor='#feb209'))
+def get_qc_image(grid, left_side, months):
+    """Get the QC image for the page and report it if it looks wrong."""
+    qc_image = QCImage(grid, left_side, months)
+    if qc_image.reasons:
+        print(f'Suspicious: {"; ".join(qc_image.reasons)}')
+        instrument.count('suspicious_pages')
+    return qc_image
 
 
-def color_col_labels(month, ax):
-    """Color the column labels for the given month image."""
-    for col, cell in enumerate(month.header_row):
-        if month.col_labels[col]:
-            top_left, width, height = cell.get_patch()
-            ax.add_patch(patches.Rectangle(
-                top_left,
-                width,
-                height,
-                alpha=0.5,
-                facecolor='#feb209'))
+def qc_image_path(base_name, image_dir='output'):
+    """Get the file name of a page's QC image."""
+    return os.path.join(image_dir, base_name + '_out.png')
 
 
-def color_grid_cells(month, month_idx, ax, base_name, writer):
+def output_results(base_name, csv_path, grid, months, left_side,
+                   image_dir='output', store=None):
+    """Output the observations and, if wanted, the QC image."""
+    with instrument.stage('write_csv'):
+        write_observations(csv_path, base_name,
+                           [day_matrix(m) for m in months], store)
+
+    qc_image = get_qc_image(grid, left_side, months)
+    if qc_image.wanted:
+        with instrument.stage('render_qc'):
+            qc_image.save(qc_image_path(base_name, image_dir))
+
+
+def load_page(image, owned=False):
+    """Build the page grid from an image array or an image file."""
+    with instrument.stage('load'):
+        if isinstance(image, str):
+            grid = Grid(file_name=image)
+        else:
+            grid = Grid(image=image, owned=owned)
+    if instrument.is_enabled():
+        instrument.count('ink_pixels', int(np.count_nonzero(grid.line_ink)))
+        instrument.count('page_pixels', grid.line_ink.size)
+    return grid
+
+
+def find_slashes(months):
+    """Find the cells with slashes in every month."""
+    with instrument.stage('get_slashes'):
+        for month in months:
+            month.get_slashes()
+
+
+def process_page(page_name, image, csv_path, cache=None, store=None):
     """
-    Color the grid cells with slashes for the given month image.
+    Process one page.
 
-    Also write row data to the CSV file.
+    The image is either an array or the name of an image file. The page name
+    is used as the file name in the CSV. The observations go to the store, if
+    there is one, instead of the CSV file. Returns the instrumentation record
+    for the page, if there is one.
     """
-    for row_idx, cell_row in enumerate(month.cells[1:]):
-        csv_row = [base_name, month_idx + 1, '', '', row_idx + 1, '']
-        csv_cells = ['' for _ in range(31)]
-        day = -1
-        for col, cell in enumerate(cell_row):
-            if month.col_labels[col]:
-                day += 1
-                if cell.has_line(Cell.forward_slashes):
-                    csv_cells[day] = 1
-                    top_left, width, height = cell.get_patch()
-                    ax.add_patch(patches.Rectangle(
-                        top_left, width,
-                        height,
-                        alpha=0.5,
-                        facecolor='#39ad48'))
-        csv_row += csv_cells
-        writer.writerow(csv_row)
+    source = image if isinstance(image, str) else page_name
+    print(f'Processing: {source}')
+    instrument.start_page(source)
 
+    grid = load_page(image)
+    left_side, months = find_geometry(grid, cache)
+    find_slashes(months)
 
-def output_results(in_file, csv_path, grid, months, left_side):
-    """Output the image and CSV data."""
-    file_name = os.path.basename(in_file)
+    with instrument.stage('output_results'):
+        output_results(page_name, csv_path, grid, months, left_side,
+                       store=store)
 
-    base_name, _ = os.path.splitext(file_name)
-    img_path = os.path.join('output', base_name + '_out.png')
+    return instrument.end_page()
 
-    with open(csv_path, 'a', newline='') as csv_file:
-        writer = csv.writer(csv_file)
 
-        fig, ax = plt.subplots(figsize=(10, 15.45), frameon=False)
-        ax.imshow(grid.image, cmap=plt.cm.gray)
-        ax.axis('off')
+def read_page(page):
+    """Decode a page's image file. This is the pipeline's read stage."""
+    page_name, image = page
+    if isinstance(image, str):
+        return page_name, image, io.imread(image)
+    return page_name, page_name, image
 
-        color_row_labels(left_side, ax)
 
-        for month_idx, month in enumerate(months):
-            color_col_labels(month, ax)
-            color_grid_cells(month, month_idx, ax, base_name, writer)
+def analyze_page(page, cache=None):
+    """
+    Analyze a page that has been read. This is the pipeline's analyze stage.
 
-    fig.savefig(img_path, dpi=300, bbox_inches='tight')
+    Returns the page's day matrices and, if it is wanted, its QC image for
+    the write stage.
+    """
+    page_name, source, image = page
+    print(f'Processing: {source}')
+    instrument.start_page(source)
 
+    grid = load_page(image, owned=True)
+    left_side, months = find_geometry(grid, cache)
+    find_slashes(months)
 
-def process_image(file_name, csv_path):
-    """Process one image."""
-    print(f'Processing: {file_name}')
-    grid = Grid(file_name=file_name)
+    days = [day_matrix(month) for month in months]
 
-    left_side = get_left_side(grid)
+    qc_image = get_qc_image(grid, left_side, months)
+    return PageResult(page_name, days, qc_image if qc_image.wanted else None,
+                      instrument.end_page())
 
-    months = get_month_graph_areas(grid, left_side)
-    build_month_graphs(months)
 
-    output_results(file_name, csv_path, grid, months, left_side)
-    plt.close()
+def analyze_file(page, cache=None):
+    """Read and analyze a page. This is the daemon's analysis."""
+    return analyze_page(read_page(page), cache)
+
+
+def write_page(csv_path, result, store=None):
+    """Write a page's results. This is the pipeline's write stage."""
+    write_observations(csv_path, result.name, result.months, store)
+    if result.qc:
+        result.qc.save(qc_image_path(result.name))
+
+
+def process_image(file_name, csv_path, cache=None):
+    """Process one image file."""
+    return process_page(page_id(file_name), file_name, csv_path, cache)
 
 
 def init_csv_file(csv_path):
     """Initialize the CSV file."""
     with open(csv_path, 'w', newline='') as csv_file:
         writer = csv.writer(csv_file)
-        header = ['file_name', 'chart_in_file',
-                  'year', 'month', 'row_no', 'bird_species']
-        header += list(range(1, 32))
-        writer.writerow(header)
+        writer.writerow(CSV_HEADER)
+
+
+def process_shard(page_name, image, shard_dir, cache=None):
+    """Process one page into its own CSV shard."""
+    shard_path = os.path.join(shard_dir, page_name + '.csv')
+    open(shard_path, 'w').close()
+    record = process_page(page_name, image, shard_path, cache)
+    return page_name, shard_path, record
+
+
+def serial_shards(pages, shard_dir, cache=None):
+    """Process the pages into CSV shards one at a time."""
+    for page_name, image in pages:
+        yield process_shard(page_name, image, shard_dir, cache)
+
+
+def pool_shards(pages, shard_dir, workers, args, cache=None):
+    """
+    Process the pages into CSV shards with a pool of worker processes.
+
+    The results are yielded in the input order. Only a few pages per worker
+    are in flight so the pages can be streamed.
+    """
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=configure,
+                             initargs=(args,)) as executor:
+        pending = deque()
+        for page_name, image in pages:
+            pending.append(executor.submit(
+                process_shard, page_name, image, shard_dir, cache))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def merge_shards(csv_path, shard_paths):
+    """Append the CSV shards to the CSV file in the given order."""
+    with open(csv_path, 'a', newline='') as csv_file:
+        for shard_path in shard_paths:
+            with open(shard_path, newline='') as shard_file:
+                shutil.copyfileobj(shard_file, csv_file)
+
+
+def process_batch(pages, csv_path, workers, args, cache=None):
+    """
+    Process the pages with a pool of worker processes.
+
+    Each page is written to its own CSV shard and the shards are merged in
+    the input order so that the CSV file matches a serial run. Returns the
+    instrumentation records for the pages.
+    """
+    shard_dir = os.path.join(os.path.dirname(csv_path), 'shards')
+    os.makedirs(shard_dir, exist_ok=True)
+
+    results = list(pool_shards(pages, shard_dir, workers, args, cache))
+
+    init_csv_file(csv_path)
+    merge_shards(csv_path, [r[1] for r in results])
+    shutil.rmtree(shard_dir)
+
+    return [r[2] for r in results]
+
+
+def process_incremental(pages, csv_path, workers, args, cache=None):
+    """
+    Process only the new or changed pages.
+
+    Every page's CSV rows are kept in their own file and the manifest records
+    what they were built from. Pages with the same content and parameters as
+    last time are skipped and the CSV file is rebuilt from the per-page files.
+    Returns the instrumentation records for the processed pages.
+    """
+    out_dir = os.path.dirname(csv_path)
+    page_dir = os.path.join(out_dir, 'pages')
+    os.makedirs(page_dir, exist_ok=True)
+
+    manifest = Manifest(os.path.join(out_dir, 'manifest.jsonl'))
+    params = fingerprint()
+    page_names, digests = [], {}
+
+    def changed_pages():
+        for page_name, image in pages:
+            page_names.append(page_name)
+            digests[page_name] = content_hash(image)
+            if manifest.is_current(page_name, digests[page_name], params):
+                print(f'Skipping: {page_name}')
+            else:
+                yield page_name, image
+
+    if workers > 1:
+        results = pool_shards(changed_pages(), page_dir, workers, args, cache)
+    else:
+        results = serial_shards(changed_pages(), page_dir, cache)
+
+    records = []
+    for page_name, page_path, record in results:
+        manifest.record(page_name, digests[page_name], params, page_path)
+        records.append(record)
+
+    manifest.compact()
+
+    init_csv_file(csv_path)
+    merge_shards(csv_path, [manifest.output(p) for p in page_names])
+
+    return records
+
+
+def process_pipelined(pages, csv_path, workers, args, cache=None,
+                      store=None):
+    """
+    Process the pages with the reads and writes overlapping the analysis.
+
+    The pages are analyzed in this process, or with a pool of worker
+    processes. Returns the instrumentation records for the pages.
+    """
+    if not store:
+        init_csv_file(csv_path)
+
+    if workers > 1:
+        executor = ProcessPoolExecutor(
+            max_workers=workers, initializer=configure, initargs=(args,))
+    else:
+        executor = ThreadPoolExecutor(1)
+
+    with executor:
+        pipeline = Pipeline(read_page,
+                            partial(analyze_page, cache=cache),
+                            partial(write_page, csv_path, store=store),
+                            executor,
+                            workers=workers,
+                            prefetch=args.prefetch)
+        results = pipeline.run(pages)
+
+    return [r.record for r in results]
+
+
+def warm_up():
+    """Run the line finders once so a worker's first page is not slower."""
+    Grid(image=np.ones((256, 256), dtype=bool)).find_grid_lines()
+
+
+def rebuild_csv(csv_path, manifest):
+    """
+    Rebuild the CSV file from the saved results of every page.
+
+    The pages are in the order they were first added to the manifest, which
+    is the order they were appended to the CSV file.
+    """
+    init_csv_file(csv_path)
+    merge_shards(csv_path, [manifest.output(p) for p in manifest.entries
+                            if os.path.exists(manifest.output(p))])
+
+
+def process_watched(csv_path, workers, args, cache=None):
+    """
+    Process pages as they arrive until interrupted.
+
+    Pages arrive in the images directory, or over a socket with --socket.
+    Like resumable runs, each page's rows are kept in their own file and
+    recorded in the manifest, so pages that are already current are skipped
+    when the daemon restarts. New pages are appended to the CSV file. When a
+    page changes the CSV file is rebuilt with the page where it was, so the
+    pages stay in the order they first arrived. Returns the instrumentation
+    records for the processed pages.
+    """
+    out_dir = os.path.dirname(csv_path)
+    page_dir = os.path.join(out_dir, 'pages')
+    os.makedirs(page_dir, exist_ok=True)
+
+    manifest = Manifest(os.path.join(out_dir, 'manifest.jsonl'))
+    params = fingerprint()
+    digests = {}
+    rebuild_csv(csv_path, manifest)
+
+    def accept(arrival):
+        digests[arrival.name] = content_hash(arrival.path)
+        return not manifest.is_current(
+            arrival.name, digests[arrival.name], params)
+
+    def write(result):
+        page_path = os.path.join(page_dir, result.name + '.csv')
+        open(page_path, 'w').close()
+        write_page(page_path, result)
+        replaced = result.name in manifest.entries
+        manifest.record(
+            result.name, digests[result.name], params, page_path)
+        if replaced:
+            rebuild_csv(csv_path, manifest)
+        else:
+            merge_shards(csv_path, [page_path])
+
+    sources = [DirectoryWatcher('images/*.png', args.watch_interval)]
+    if args.socket:
+        sources.append(SocketListener(args.socket))
+
+    if workers > 1:
+        executor = ProcessPoolExecutor(
+            max_workers=workers, initializer=configure, initargs=(args,))
+    else:
+        executor = ThreadPoolExecutor(1)
+
+    with executor:
+        wait([executor.submit(warm_up) for _ in range(workers)])
+        print('Waiting for pages')
+        daemon = Daemon(partial(analyze_file, cache=cache), write, executor,
+                        workers=workers, accept=accept)
+        records = daemon.run(sources)
+
+    manifest.compact()
+    return records
+
+
+def write_report(csv_path, records):
+    """Write the page records to a JSON lines file next to the CSV file."""
+    report_path = os.path.splitext(csv_path)[0] + '_report.jsonl'
+    with open(report_path, 'w') as report_file:
+        for record in records:
+            report_file.write(json.dumps(record) + '\n')
+
+
+def configure(args):
+    """Set the tunable parameters from the command-line arguments."""
+    Grid.ink_block_size = args.ink_block_size
+    Grid.ink_offset = args.ink_offset
+    Grid.ink_thinning = args.ink_thinning
+    Grid.tiles = args.tiles
+    Grid.spill_dir = args.spill_dir
+    Grid.ink_tile_bytes = args.ink_tile_mb * 2 ** 20
+    if args.spill_dir:
+        GridLines.tile_bytes = Grid.ink_tile_bytes
+    GridLines.engine = args.line_engine
+    GridLines.thinned = args.ink_thinning
+    GridLines.coarse_size = args.coarse_size
+    instrument.enable(args.report)
+    threads.enable(args.threads)
+    layout_prior.enable(args.layout_prior)
+    QCImage.mode = args.qc
+    QCImage.scale = args.qc_scale
+    QCImage.renderer = args.qc_renderer
+
+
+def parse_args(argv=None):
+    """Process command-line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--workers', type=int, default=1,
+        help="""Process pages with this many worker processes.
+            (default: %(default)s)""")
+    parser.add_argument(
+        '--threads', type=int, default=1,
+        help="""Use this many threads within each page for the month grids and
+            the cell classification. (default: %(default)s)""")
+    parser.add_argument(
+        '--pdf', nargs='*',
+        help="""Read the pages straight from these PDF files instead of the
+            PNG files in the images directory.""")
+    parser.add_argument(
+        '--pdf-dpi', type=int, default=300,
+        help="""Render the PDF pages at this resolution.
+            (default: %(default)s)""")
+    parser.add_argument(
+        '--pipeline', action='store_true',
+        help="""Read upcoming pages and write finished pages while other pages
+            are analyzed. Works with --workers.""")
+    parser.add_argument(
+        '--prefetch', type=int, default=2,
+        help="""How many pages may wait between the pipeline stages.
+            (default: %(default)s)""")
+    parser.add_argument(
+        '--resume', action='store_true',
+        help="""Only process the pages that are new or have changed since the
+            last resumable run, then rebuild the CSV file from the saved
+            results of every page.""")
+    parser.add_argument(
+        '--format', choices=['csv', 'binary', 'sqlite'], default='csv',
+        help="""Write the observations to the CSV file, to a bit-packed
+            binary store in the output directory, or to an indexed SQLite
+            database in the output directory. Pages already in the database
+            are replaced. The binary store and the database are written by
+            one process, so --workers uses the pipeline. Use
+            export_observations.py to get the CSV file or a columnar copy of
+            the binary store. (default: %(default)s)""")
+    parser.add_argument(
+        '--watch', action='store_true',
+        help="""Run as a daemon. Keep the workers warm and process the pages
+            as they show up in the images directory until interrupted. Pages
+            that were already processed are skipped like --resume.""")
+    parser.add_argument(
+        '--watch-interval', type=float, default=1.0,
+        help="""How often, in seconds, to look for new pages with --watch.
+            (default: %(default)s)""")
+    parser.add_argument(
+        '--socket',
+        help="""With --watch, also accept page image paths, one per line, on
+            a Unix socket at this path. Each page is answered with a line once
+            its rows are in the CSV file.""")
+    parser.add_argument(
+        '--ink-block-size', type=int, default=0,
+        help="""Binarize grey scale scans with a local adaptive threshold
+            using blocks of this many pixels. It must be odd. Zero uses a
+            global threshold. (default: %(default)s)""")
+    parser.add_argument(
+        '--ink-offset', type=float, default=0.04,
+        help="""Subtract this fraction of the intensity range from the
+            local adaptive threshold, so flat paper is not ink.
+            (default: %(default)s)""")
+    parser.add_argument(
+        '--ink-thinning', action='store_true',
+        help="""Find the grid lines in ink that is thinned to one pixel
+            wide strokes. The cells are still read from all of the ink.""")
+    parser.add_argument(
+        '--line-engine', choices=['hough', 'profile', 'coarse'],
+        default='hough',
+        help="""Find the grid lines with the Hough Transform, with sheared
+            projection profiles, or with the Hough Transform on a shrunken
+            image followed by refinement at full resolution.
+            (default: %(default)s)""")
+    parser.add_argument(
+        '--tiles', type=int, default=2,
+        help="""Month grids with more than 32 rows are cut into this many
+            overlapping bands of rows. The lines are found in each band and
+            the columns are stitched across the bands so bent scans can be
+            followed. Use 0 for one band for every 16 rows.
+            (default: %(default)s)""")
+    parser.add_argument(
+        '--layout-prior', action='store_true',
+        help="""Look for each page's grid lines near where they were on the
+            previous page and fall back to a full search when they are not
+            there. Consecutive pages share their ruling. --report shows how
+            often the prior was accepted.""")
+    parser.add_argument(
+        '--coarse-size', type=int, default=1024,
+        help="""The coarse line engine shrinks each image to about this many
+            pixels on its longest side. (default: %(default)s)""")
+    parser.add_argument(
+        '--spill-dir',
+        help="""Large image mode for high resolution scans. Each page's ink
+            map is built in tiles and kept in a memory mapped file in this
+            directory, and the Hough Transforms vote one tile at a time. Only
+            the ink map is spilled. The page image is still decoded whole
+            before its ink map is built, so that is the least memory a page
+            needs.""")
+    parser.add_argument(
+        '--ink-tile-mb', type=int, default=64,
+        help="""The memory budget in MB for each ink map tile in large image
+            mode. It does not limit the memory for decoding the page image.
+            (default: %(default)s)""")
+    parser.add_argument(
+        '--cache-dir',
+        help="""Cache the grid geometry of each page in this directory. Re-runs
+            with the same pages and line finding parameters skip straight to
+            the cell classification.""")
+    parser.add_argument(
+        '--cache-size', type=int, default=256,
+        help="""The maximum size of the cache in MB. The least recently used
+            entries are removed first. (default: %(default)s)""")
+    parser.add_argument(
+        '--qc', choices=['all', 'suspicious', 'none'], default='all',
+        help="""Which pages get a quality control image. Suspicious pages are
+            missing months or day columns, or lost part of a split grid.
+            (default: %(default)s)""")
+    parser.add_argument(
+        '--qc-scale', type=float, default=1.0,
+        help="""Scale the quality control images by this factor.
+            (default: %(default)s)""")
+    parser.add_argument(
+        '--qc-renderer', choices=['numpy', 'matplotlib'], default='numpy',
+        help="""Draw the quality control images straight into the page
+            image or as a matplotlib figure. (default: %(default)s)""")
+    parser.add_argument(
+        '--report', action='store_true',
+        help="""Time the stages and hot paths of each page and count the cells.
+            The records go to a JSON lines file next to the CSV file and a
+            summary is printed at the end.""")
+    return parser.parse_args(argv)
+
+
+def main(args):
+    """Process all of the images."""
+    configure(args)
+
+    cache = None
+    if args.cache_dir:
+        cache = GeometryCache(args.cache_dir, args.cache_size * 1024 * 1024)
+
+    csv_path = 'output/boyd_bird_journal-v0.1.1.csv'
+    if args.pdf:
+        pages = pdf_pages(args.pdf, dpi=args.pdf_dpi)
+    else:
+        pages = image_file_pages(sorted(glob.glob('images/*.png')))
+
+    store = None
+    if args.format != 'csv' and (args.watch or args.resume):
+        raise SystemExit(f'--format {args.format} does not work with --watch '
+                         'or --resume')
+    if args.format == 'binary':
+        store = ObservationStore(os.path.dirname(csv_path))
+        store.clear()
+    elif args.format == 'sqlite':
+        store = ObservationDatabase(
+            os.path.splitext(csv_path)[0] + '.sqlite')
+
+    if args.watch:
+        records = process_watched(csv_path, args.workers, args, cache)
+    elif args.resume:
+        records = process_incremental(
+            pages, csv_path, args.workers, args, cache)
+    elif args.pipeline or (store and args.workers > 1):
+        records = process_pipelined(
+            pages, csv_path, args.workers, args, cache, store)
+    elif args.workers > 1:
+        records = process_batch(pages, csv_path, args.workers, args, cache)
+    else:
+        if not store:
+            init_csv_file(csv_path)
+        records = [process_page(n, i, csv_path, cache, store)
+                   for n, i in pages]
+
+    if store:
+        store.close()
+
+    if args.report:
+        write_report(csv_path, records)
+        for line in instrument.summarize(records):
+            print(line)
 
 
 if __name__ == '__main__':
-    CSV_PATH = 'output/boyd_bird_journal-v0.1.1.csv'
-    init_csv_file(CSV_PATH)
-    for image_file_name in sorted(glob.glob('images/*.png')):
-        process_image(image_file_name, CSV_PATH)
+    main(parse_args())
@@ -0,0 +1,39 @@
+"""Export the binary observation store to a CSV file, columns, or SQLite."""
+
+# pylint: disable=invalid-name
+
+import argparse
+
+from lib.database import ObservationDatabase
+from lib.observations import ObservationStore
+
+
+def parse_args():
+    """Process command-line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        'format', choices=['csv', 'columns', 'sqlite'],
+        help="""Export to the CSV file layout, to a directory with a .npy
+            file for each column, or add the pages to a SQLite database.""")
+    parser.add_argument(
+        'target',
+        help="""The CSV file, column directory, or database to write.""")
+    parser.add_argument(
+        '--store', default='output',
+        help="""The directory with the observation store.
+            (default: %(default)s)""")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    ARGS = parse_args()
+    STORE = ObservationStore(ARGS.store)
+    if ARGS.format == 'csv':
+        STORE.export_csv(ARGS.target)
+    elif ARGS.format == 'columns':
+        STORE.export_columns(ARGS.target)
+    else:
+        DATABASE = ObservationDatabase(ARGS.target)
+        for PAGE_NAME, MONTHS in STORE.pages():
+            DATABASE.append(PAGE_NAME, MONTHS)
+        DATABASE.close()
@@ -1,42 +1,99 @@
 """Data and functions for dealing with cell contents."""
 
-# pylint: disable=no-member, too-many-instance-attributes, too-many-arguments
+# pylint: disable=no-member
 
+import inspect
 
 import numpy as np
-from skimage import util
 from skimage.transform import probabilistic_hough_line
 
-from lib.util import Crop, Offset, intersection
+from lib import instrument
+from lib.detections import detector_key
+from lib.util import Crop, Offset, Point
+
+# scikit-image 0.19 renamed the probabilistic Hough Transform's seed to rng
+SEED_ARG = 'rng' if 'rng' in inspect.signature(
+    probabilistic_hough_line).parameters else 'seed'
 
 
 class Cell:
     """Data and functions for dealing with cell contents."""
 
-    row_label_threshold = 20
-    col_label_threshold = 15
     crop = Crop(top=4, bottom=4, left=4, right=4)
-    forward_slashes = np.deg2rad(np.linspace(65.0, 25.0, num=161))
+    slash_scan = np.deg2rad(np.linspace(65.0, 25.0, num=41))
     label_lines = np.deg2rad(np.linspace(0.0, 65.0, num=181))
     label_lines += np.deg2rad(np.linspace(-65.0, 0.0, num=181))
 
-    def __init__(self, grid, top=None, bottom=None, left=None, right=None):
-        """
-        Build a cell from the 4 surrounding grid lines.
+    # Cells whose interior is more than this fraction ink are labels without
+    # looking for lines. On the sample pages, cells without a label line are
+    # at most 2.2% ink and cells with one are 3.5% to 30% ink.
+    label_fill = 0.1
+
+    # Cells with less ink than this are rejected without looking for lines.
+    # The probabilistic Hough Transform needs 10 votes for a line so a floor
+    # up to 10 pixels does not change any results.
+    min_ink = 10
 
-        We will also get the for corners of the cell by finding the
-        intersection of the grid lines.
+    # The probabilistic Hough Transform's random seed
+    hough_seed = 0
+
+    def __init__(self, table, row, col):
         """
-        self.image = grid.edges
-        self.top_left = intersection(top, left)
-        self.bottom_left = intersection(bottom, left)
-        self.top_right = intersection(top, right)
-        self.bottom_right = intersection(bottom, right)
-        self.width = self.top_right.x - self.top_left.x
-        self.height = self.bottom_left.y - self.top_left.y
-        self.offset = Offset(x=grid.offset.x + self.top_left.x,
-                             y=grid.offset.y + self.top_left.y)
+        A view of one cell in a cell table.
 
+        The cell's corners are the intersections of the 4 surrounding grid
+        lines, and they are kept in the table.
+        """
+        self.table = table
+        self.row = row
+        self.col = col
+
+    @property
+    def image(self):
+        """Get the image the cell is in."""
+        return self.table.image
+
+    @property
+    def top_left(self):
+        """Get the top left corner of the cell."""
+        return self.corner(self.row, self.col)
+
+    @property
+    def bottom_left(self):
+        """Get the bottom left corner of the cell."""
+        return self.corner(self.row + 1, self.col)
+
+    @property
+    def top_right(self):
+        """Get the top right corner of the cell."""
+        return self.corner(self.row, self.col + 1)
+
+    @property
+    def bottom_right(self):
+        """Get the bottom right corner of the cell."""
+        return self.corner(self.row + 1, self.col + 1)
+
+    @property
+    def width(self):
+        """Get the width of the cell's top edge."""
+        return self.top_right.x - self.top_left.x
+
+    @property
+    def height(self):
+        """Get the height of the cell's left edge."""
+        return self.bottom_left.y - self.top_left.y
+
+    @property
+    def offset(self):
+        """Get the page position of the cell."""
+        return Offset(x=self.table.offset.x + self.top_left.x,
+                      y=self.table.offset.y + self.top_left.y)
+
+    def corner(self, row, col):
+        """Get a grid line intersection from the table."""
+        return Point(int(self.table.x[row, col]), int(self.table.y[row, col]))
+
+    @instrument.timed
     def interior(self, crop=None):
         """
         Get the interior image of the cell.
@@ -45,45 +102,60 @@ class Cell:
         surrounding grid lines. That is, we want the cell contents, not the
         grid lines.
         """
-        top = max(0, self.top_left.y, self.top_right.y)
-        bottom = max(0, self.image.shape[0]
-                     - min(self.bottom_left.y, self.bottom_right.y))
-        left = max(0, self.top_left.x, self.bottom_left.x)
-        right = max(0, self.image.shape[1]
-                    - min(self.top_right.x, self.bottom_right.x))
-
-        inside = util.crop(self.image, ((top, bottom), (left, right)))
-
-        if crop and inside.shape[1] > (crop.right + crop.left) \
-                and inside.shape[0] > (crop.bottom + crop.top):
-            inside = util.crop(
-                inside,
-                ((crop.top, crop.bottom), (crop.left, crop.right)))
-
-        return inside
+        return self.table.interior(self.row, self.col, crop=crop)
 
     def is_label(self, crop=None):
-        """Determine if the cell is a column label."""
+        """
+        Determine if the cell is a column label.
+
+        Cells that are mostly ink are accepted by a cheap fill test and the
+        line search is only done for the rest.
+        """
+        instrument.count('cells_classified')
         if not crop:
             crop = self.crop
         inside = self.interior(crop=crop)
-        lines = self.has_line(self.label_lines, line_length=12)
         if not min(inside.shape):
             return False
-        return bool(len(lines)) or np.mean(inside) > self.col_label_threshold
+        instrument.count('label_tests')
+        if np.count_nonzero(inside) > self.label_fill * inside.size:
+            instrument.count('labels_by_fill')
+            return True
+        return bool(len(self.has_line(self.label_lines, line_length=12)))
 
     def has_line(self, angles=None, line_length=15):
-        """Determine if the cell has a line at any of the given angles."""
-        return probabilistic_hough_line(
-            self.interior(crop=self.crop),
-            line_length=line_length,
-            line_gap=2,
-            theta=angles)
+        """
+        Determine if the cell has a line at any of the given angles.
+
+        Each cell is only searched once for each set of angles and length.
+        """
+        key = detector_key(
+            'has_line', line_length, self.row, self.col, angles=angles)
+        return self.table.store.get(
+            key, lambda: self.find_lines(angles, line_length))
+
+    def find_lines(self, angles=None, line_length=15):
+        """
+        Search the cell for lines at any of the given angles.
+
+        Cells with too little ink to hold a line are rejected before the
+        Hough Transform. The transform samples the pixels in a random order,
+        so it is seeded to get the same lines on every run.
+        """
+        inside = self.interior(crop=self.crop)
+        instrument.count('line_tests')
+        if np.count_nonzero(inside) < self.min_ink:
+            instrument.count('line_tests_skipped')
+            return []
+        with instrument.stage('probabilistic_hough_line'):
+            return probabilistic_hough_line(
+                inside,
+                line_length=line_length,
+                line_gap=2,
+                theta=angles,
+                **{SEED_ARG: self.hough_seed})
 
     def get_patch(self):
         """Get the cell patch for output."""
-        width = self.top_right.x - self.top_left.x
-        height = self.bottom_left.y - self.top_left.y
-        offset_x = self.offset.x
-        offset_y = self.offset.y
-        return (offset_x, offset_y), width, height
+        offset = self.offset
+        return (offset.x, offset.y), self.width, self.height
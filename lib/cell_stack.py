@@ -0,0 +1,118 @@
+"""Find lines in many cells at once."""
+
+# pylint: disable=invalid-name
+
+import numpy as np
+
+from lib import instrument, threads
+
+
+def stack_interiors(cells, crop=None):
+    """
+    Pack the cell interiors into one zero padded image stack.
+
+    The cells are given as rows of a cell table. We return the stack and the
+    row and column index of each image in the stack.
+    """
+    images, bounds, rows, cols = [], [], [], []
+    for row_idx, row in enumerate(cells):
+        row_bounds = np.stack(
+            row.table.interior_bounds(crop), axis=-1)[row.row]
+        images += [row.table.image] * len(row_bounds)
+        bounds.append(row_bounds)
+        rows += [row_idx] * len(row_bounds)
+        cols += range(len(row_bounds))
+
+    bounds = np.concatenate(bounds) if bounds else np.zeros((0, 4), dtype=int)
+    height = (bounds[:, 1] - bounds[:, 0]).max(initial=0)
+    width = (bounds[:, 3] - bounds[:, 2]).max(initial=0)
+    stack = np.zeros((len(bounds), height, width), dtype=bool)
+    for i, (top, bottom, left, right) in enumerate(bounds.tolist()):
+        stack[i, :bottom - top, :right - left] = \
+            images[i][top:bottom, left:right]
+
+    return stack, np.array(rows, dtype=int), np.array(cols, dtype=int)
+
+
+@instrument.timed
+def line_votes(stack, angles, line_length=15, line_gap=2,
+               chunk_size=2 ** 20):
+    """
+    Determine which images in the stack have a line at any of the angles.
+
+    All images in the stack share the same frame so every ink pixel, from
+    every image, is voted into one accumulator with a single bincount. The
+    angles are voted in chunks to cap the memory used by the bins.
+
+    Like the probabilistic Hough Transform, a line is an unbroken run of
+    pixels, at least line_length long, with gaps of at most line_gap pixels.
+    So the pixels in every bin with enough votes are sorted by their
+    position along the line and split into runs where the gaps are too wide.
+    """
+    count, height, width = stack.shape
+    found = np.zeros(count, dtype=bool)
+    if not count:
+        return found
+
+    image_idx, y, x = np.nonzero(stack)
+
+    max_dist = int(np.ceil(np.hypot(height, width)))
+    dists = 2 * max_dist + 1
+
+    step = max(1, chunk_size // max(1, len(x)))
+    for start in range(0, len(angles), step):
+        chunk = angles[start:start + step]
+        cos = np.cos(chunk)[:, np.newaxis]
+        sin = np.sin(chunk)[:, np.newaxis]
+
+        rhos = np.round(cos * x + sin * y).astype(np.intp) + max_dist
+
+        bins = image_idx * len(chunk) + np.arange(len(chunk))[:, np.newaxis]
+        bins = (bins * dists + rhos).ravel()
+
+        votes = np.bincount(bins, minlength=count * len(chunk) * dists)
+        strong = votes[bins] >= line_length
+        if not strong.any():
+            continue
+
+        along = np.round(cos * y - sin * x).astype(np.intp) + max_dist
+        runs = np.sort(bins[strong] * dists + along.ravel()[strong])
+        bins, along = np.divmod(runs, dists)
+
+        breaks = (np.diff(bins) != 0) | (np.diff(along) > line_gap + 1)
+        firsts = np.flatnonzero(np.concatenate(([True], breaks)))
+        lasts = np.concatenate((firsts[1:], [len(bins)])) - 1
+        long = along[lasts] - along[firsts] + 1 >= line_length
+        found[bins[firsts[long]] // (len(chunk) * dists)] = True
+
+    return found
+
+
+def has_lines(cells, angles, line_length=15, crop=None):
+    """
+    Determine which cells have a line at any of the given angles.
+
+    A cell has a line when it has a run of pixels on one line, at least
+    line_length long, with gaps of at most 2 pixels. The result is a boolean
+    matrix with a row per row of cells. Ragged rows are padded with False.
+
+    A cell with fewer than line_length ink pixels cannot have line_length
+    votes, so those cells are dropped before voting. The remaining stack is
+    split between the threads.
+    """
+    stack, rows, cols = stack_interiors(cells, crop=crop)
+    instrument.count('cells_classified', len(stack))
+
+    inked = stack.reshape(len(stack), -1).sum(axis=1) >= line_length
+    instrument.count('line_tests', len(stack))
+    instrument.count('line_tests_skipped', int(len(stack) - inked.sum()))
+    stack, rows, cols = stack[inked], rows[inked], cols[inked]
+
+    found = np.zeros(
+        (len(cells), max([len(r) for r in cells], default=0)), dtype=bool)
+    lines = threads.map_ordered(
+        lambda part: line_votes(part, angles, line_length),
+        np.array_split(stack, threads.Threads.count))
+    found[rows, cols] = np.concatenate(lines)
+
+    return found
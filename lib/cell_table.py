@@ -0,0 +1,156 @@
+"""The cells of a grid held as arrays."""
+
+import numpy as np
+
+from lib.cell import Cell
+from lib.detections import detector_key
+from lib.util import intersections
+
+
+def slice_bounds(start, stop, size):
+    """
+    Get the bounds of slice(start, stop) on an axis of the given size.
+
+    These follow the Python slice rules so that the bounds match slicing the
+    image. The starts are never negative.
+    """
+    stop = np.where(stop < 0, stop + size, stop)
+    stop = np.clip(stop, 0, size)
+    start = np.minimum(start, size)
+    return start, np.maximum(start, stop)
+
+
+class CellTable:
+    """
+    All of the cells in a grid.
+
+    Adjacent cells share their corners so we only keep the intersections of
+    the grid lines. The corners of the cell at [row, col] are the points at
+    [row, col], [row, col + 1], [row + 1, col], and [row + 1, col + 1]. Cells
+    are only built as objects when they are asked for. Interiors and
+    detection results are kept in the grid's detection store.
+    """
+
+    def __init__(self, grid, horiz_lines, vert_lines):
+        """Find every intersection of the horizontal and vertical lines."""
+        self.image = grid.edges
+        self.offset = grid.offset
+        self.store = grid.store
+
+        self.x, self.y = intersections(horiz_lines, vert_lines)
+
+    @property
+    def shape(self):
+        """Get the number of rows and columns of cells."""
+        return max(0, self.x.shape[0] - 1), max(0, self.x.shape[1] - 1)
+
+    @property
+    def size(self):
+        """Get the number of cells."""
+        rows, cols = self.shape
+        return rows * cols
+
+    @property
+    def width(self):
+        """Get the width of every cell."""
+        return self.x[:-1, 1:] - self.x[:-1, :-1]
+
+    @property
+    def height(self):
+        """Get the height of every cell."""
+        return self.y[1:, :-1] - self.y[:-1, :-1]
+
+    @property
+    def offset_x(self):
+        """Get the page position of every cell's left edge."""
+        return self.offset.x + self.x[:-1, :-1]
+
+    @property
+    def offset_y(self):
+        """Get the page position of every cell's top edge."""
+        return self.offset.y + self.y[:-1, :-1]
+
+    @property
+    def patches(self):
+        """Get the cell patches for output as an array of (x, y, w, h)."""
+        return np.stack(
+            [self.offset_x, self.offset_y, self.width, self.height], axis=-1)
+
+    def interior_bounds(self, crop=None):
+        """
+        Get the image bounds of every cell's interior.
+
+        This is Cell.interior for all cells at once. We return the top,
+        bottom, left, and right bounds as arrays.
+        """
+        return self.store.get(detector_key('interior_bounds', crop),
+                              lambda: self.find_interior_bounds(crop))
+
+    def find_interior_bounds(self, crop=None):
+        """Calculate the image bounds of every cell's interior."""
+        x, y = self.x, self.y
+        height, width = self.image.shape
+
+        top = np.maximum.reduce([np.zeros_like(y[:-1, :-1]),
+                                 y[:-1, :-1], y[:-1, 1:]])
+        bottom = np.maximum(0, height - np.minimum(y[1:, :-1], y[1:, 1:]))
+        left = np.maximum.reduce([np.zeros_like(x[:-1, :-1]),
+                                  x[:-1, :-1], x[1:, :-1]])
+        right = np.maximum(0, width - np.minimum(x[:-1, 1:], x[1:, 1:]))
+
+        top, bottom = slice_bounds(top, height - bottom, height)
+        left, right = slice_bounds(left, width - right, width)
+
+        if crop:
+            inside = (right - left > crop.right + crop.left) \
+                & (bottom - top > crop.bottom + crop.top)
+            top, bottom = (np.where(inside, top + crop.top, top),
+                           np.where(inside, bottom - crop.bottom, bottom))
+            left, right = (np.where(inside, left + crop.left, left),
+                           np.where(inside, right - crop.right, right))
+
+        return top, bottom, left, right
+
+    def interior(self, row, col, crop=None):
+        """Get the interior image of a cell."""
+        def find_interior():
+            top, bottom, left, right = self.interior_bounds(crop)
+            return self.image[top[row, col]:bottom[row, col],
+                              left[row, col]:right[row, col]]
+
+        return self.store.get(
+            detector_key('interior', crop, row, col), find_interior)
+
+    def rows(self):
+        """Get the rows of cells."""
+        return [CellRow(self, row) for row in range(self.shape[0])]
+
+
+class CellRow:
+    """A row of cells in a cell table. It works like a list of cells."""
+
+    def __init__(self, table, row):
+        """Remember where the row is."""
+        self.table = table
+        self.row = row
+
+    def __len__(self):
+        """Get the number of cells in the row."""
+        return self.table.shape[1]
+
+    def __getitem__(self, col):
+        """Build a cell in the row."""
+        if col < 0:
+            col += len(self)
+        if not 0 <= col < len(self):
+            raise IndexError('cell index out of range')
+        return Cell(self.table, self.row, col)
+
+    def __iter__(self):
+        """Build each cell in the row."""
+        return (Cell(self.table, self.row, c) for c in range(len(self)))
+
+    def patches(self):
+        """Get the cell patches for output in the same form as get_patch."""
+        return [((x, y), w, h)
+                for x, y, w, h in self.table.patches[self.row].tolist()]
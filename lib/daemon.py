@@ -0,0 +1,240 @@
+"""Keep processing journal pages as they arrive."""
+
+import glob
+import os
+import queue
+import socket
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from lib.pages import page_id
+from lib.util import Arrival
+
+
+class DirectoryWatcher:
+    """
+    Poll for new or changed page images.
+
+    A file is only reported after its size and modification time are the same
+    for two polls in a row, so pages that are still being copied are not
+    read. The arrival time is when the file was last written.
+    """
+
+    def __init__(self, pattern, interval=1.0):
+        """Watch the files matching the glob pattern."""
+        self.pattern = pattern
+        self.interval = interval
+        self.seen = {}
+        self.changing = {}
+
+    def poll(self):
+        """Get the pages that have arrived since the last poll."""
+        arrivals = []
+        for path in sorted(glob.glob(self.pattern)):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if self.seen.get(path) == signature:
+                continue
+            if self.changing.get(path) != signature:
+                self.changing[path] = signature
+                continue
+            del self.changing[path]
+            self.seen[path] = signature
+            arrivals.append(Arrival(page_id(path), path, stat.st_ctime, None))
+        return arrivals
+
+    def run(self, put, stop):
+        """Queue the arriving pages until we are stopped."""
+        while not stop.is_set():
+            for arrival in self.poll():
+                put(arrival)
+            stop.wait(self.interval)
+
+
+class Connection:
+    """
+    A client of the socket listener.
+
+    The client sends page paths, one per line, and gets a line back for each
+    page once it is done. The connection is closed after the client stops
+    sending and every page has been answered.
+    """
+
+    def __init__(self, conn):
+        """Wrap an accepted socket."""
+        self.conn = conn
+        self.lock = threading.Lock()
+        self.waiting = 0
+        self.reading = True
+
+    def expect(self):
+        """Count a page the client is waiting for."""
+        with self.lock:
+            self.waiting += 1
+
+    def reply(self, line):
+        """Answer one of the client's pages."""
+        with self.lock:
+            try:
+                self.conn.sendall((line + '\n').encode())
+            except OSError:
+                pass
+            self.waiting -= 1
+            self.close_when_done()
+
+    def done_reading(self):
+        """The client has sent all of its pages."""
+        with self.lock:
+            self.reading = False
+            self.close_when_done()
+
+    def close_when_done(self):
+        """Close the connection if there is nothing left to say."""
+        if not self.reading and not self.waiting:
+            self.conn.close()
+
+
+class SocketListener:
+    """Accept page image paths over a local Unix socket."""
+
+    def __init__(self, path):
+        """Listen on the socket path."""
+        self.path = path
+
+    def read_paths(self, conn, put):
+        """Queue the pages sent by one client."""
+        client = Connection(conn)
+        with conn.makefile('r') as lines:
+            for line in lines:
+                line = line.strip()
+                if not line:
+                    continue
+                path = os.path.abspath(line)
+                client.expect()
+                put(Arrival(page_id(path), path, time.time(), client.reply))
+        client.done_reading()
+
+    def run(self, put, stop):
+        """Accept clients until we are stopped."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+            server.bind(self.path)
+            server.listen()
+            server.settimeout(0.5)
+            while not stop.is_set():
+                try:
+                    conn, _ = server.accept()
+                except socket.timeout:
+                    continue
+                conn.settimeout(None)
+                threading.Thread(target=self.read_paths, args=(conn, put),
+                                 daemon=True).start()
+        os.remove(self.path)
+
+
+class Daemon:
+    """
+    Process pages as they arrive.
+
+    The sources, like a directory watcher or a socket listener, run in
+    threads and queue the pages as they arrive. The executor is kept for the
+    life of the daemon, so its workers stay warm, and each page is written as
+    soon as it is analyzed. The latency is from the page's arrival to its
+    rows being written.
+    """
+
+    poll_interval = 0.5
+
+    def __init__(self, analyze, write, executor, workers=1, accept=None):
+        """
+        Set up the daemon.
+
+        The executor runs analyze on (page name, path) pairs. Pages that
+        accept rejects, if it is given, are not processed.
+        """
+        self.analyze = analyze
+        self.write = write
+        self.executor = executor
+        self.workers = workers
+        self.accept = accept
+        self.records = []
+
+    def submit(self, arrivals, pending):
+        """Hand the arrived pages to the executor while it has room."""
+        while len(pending) < 2 * self.workers:
+            try:
+                arrival = arrivals.get(block=not pending,
+                                       timeout=self.poll_interval)
+            except queue.Empty:
+                return
+            try:
+                accepted = not self.accept or self.accept(arrival)
+            except OSError as err:
+                self.fail(arrival, err)
+                continue
+            if not accepted:
+                print(f'Skipping: {arrival.name}')
+                if arrival.reply:
+                    arrival.reply(f'current {arrival.name}')
+                continue
+            future = self.executor.submit(
+                self.analyze, (arrival.name, arrival.path))
+            pending[future] = arrival
+
+    def finish(self, arrival, future):
+        """Write an analyzed page and report its latency."""
+        try:
+            result = future.result()
+        except Exception as err:  # pylint: disable=broad-except
+            self.fail(arrival, err)
+            return
+
+        self.write(result)
+        latency = time.time() - arrival.time
+        print(f'Latency: {arrival.name} {latency:.3f}s')
+        if result.record:
+            result.record['latency'] = latency
+            self.records.append(result.record)
+        if arrival.reply:
+            arrival.reply(f'ok {arrival.name} {latency:.3f}')
+
+    @staticmethod
+    def fail(arrival, err):
+        """Report a page that could not be processed."""
+        print(f'Failed: {arrival.path}: {err}')
+        if arrival.reply:
+            arrival.reply(f'failed {arrival.name}')
+
+    def run(self, sources, stop=None):
+        """
+        Process the arriving pages until we are stopped or interrupted.
+
+        Returns the instrumentation records for the pages.
+        """
+        stop = stop or threading.Event()
+        arrivals = queue.Queue()
+        for source in sources:
+            threading.Thread(target=source.run, args=(arrivals.put, stop),
+                             daemon=True).start()
+
+        pending = {}
+        try:
+            while not stop.is_set():
+                self.submit(arrivals, pending)
+                if not pending:
+                    continue
+                done, _ = wait(pending, timeout=self.poll_interval,
+                               return_when=FIRST_COMPLETED)
+                for future in done:
+                    self.finish(pending.pop(future), future)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stop.set()
+
+        return self.records
@@ -0,0 +1,168 @@
+"""An indexed SQLite database of the observations with a query API."""
+
+import sqlite3
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS grid_rows (
+        id INTEGER PRIMARY KEY,
+        file_name TEXT NOT NULL,
+        chart INTEGER NOT NULL,
+        year INTEGER,
+        month INTEGER,
+        row_no INTEGER NOT NULL,
+        bird_species TEXT,
+        UNIQUE (file_name, chart, row_no));
+    CREATE TABLE IF NOT EXISTS marks (
+        row_id INTEGER NOT NULL REFERENCES grid_rows (id) ON DELETE CASCADE,
+        day INTEGER NOT NULL,
+        PRIMARY KEY (row_id, day)) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS grid_rows_chart ON grid_rows (chart);
+    CREATE INDEX IF NOT EXISTS grid_rows_month ON grid_rows (year, month);
+    CREATE INDEX IF NOT EXISTS grid_rows_row_no ON grid_rows (row_no);
+    CREATE INDEX IF NOT EXISTS marks_day ON marks (day, row_id);
+"""
+
+# The columns that lookups may be filtered or grouped by
+COLUMNS = {
+    'file_name': 'grid_rows.file_name',
+    'chart': 'grid_rows.chart',
+    'year': 'grid_rows.year',
+    'month': 'grid_rows.month',
+    'row_no': 'grid_rows.row_no',
+    'bird_species': 'grid_rows.bird_species',
+    'day': 'marks.day',
+}
+
+
+def where(filters, days=None):
+    """
+    Build the WHERE clause for the filters.
+
+    Each filter is a value, a list of values, or a (first, last) range given
+    as a tuple. The days are a (first, last) range.
+    """
+    if days is not None:
+        filters = dict(filters, day=tuple(days))
+
+    clauses, params = [], []
+    for name, value in filters.items():
+        if value is None:
+            continue
+        column = COLUMNS[name]
+        if isinstance(value, tuple):
+            clauses.append(f'{column} BETWEEN ? AND ?')
+            params += value
+        elif isinstance(value, list):
+            clauses.append(f'{column} IN ({", ".join("?" * len(value))})')
+            params += value
+        else:
+            clauses.append(f'{column} = ?')
+            params.append(value)
+
+    if not clauses:
+        return '', params
+    return 'WHERE ' + ' AND '.join(clauses), params
+
+
+class ObservationDatabase:
+    """
+    The observations in a local SQLite database.
+
+    There is a row in grid_rows for every row of every month grid and a row
+    in marks for every day with a slash. Pages are added in batches of
+    transactions, and a page that is added again replaces its old rows. The
+    year, month, and bird species are not read from the pages. They can be
+    filled in later and used in the lookups.
+    """
+
+    # How many pages to add in each transaction
+    batch_pages = 50
+
+    def __init__(self, path):
+        """Open the database and create the tables if needed."""
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.executescript(SCHEMA)
+        self.pending = 0
+
+    def append(self, page_name, months):
+        """Add a page's month grids, as boolean day matrices, in bulk."""
+        cursor = self.connection.cursor()
+        cursor.execute(
+            'DELETE FROM grid_rows WHERE file_name = ?', (page_name,))
+        cursor.executemany(
+            'INSERT INTO grid_rows (file_name, chart, row_no) '
+            'VALUES (?, ?, ?)',
+            [(page_name, chart, row_no)
+             for chart, days in enumerate(months, 1)
+             for row_no in range(1, len(days) + 1)])
+
+        ids = {(chart, row_no): row_id for row_id, chart, row_no
+               in cursor.execute(
+                   'SELECT id, chart, row_no FROM grid_rows '
+                   'WHERE file_name = ?', (page_name,))}
+        cursor.executemany(
+            'INSERT INTO marks (row_id, day) VALUES (?, ?)',
+            [(ids[chart, row_idx + 1], int(day) + 1)
+             for chart, days in enumerate(months, 1)
+             for row_idx, day in zip(*days.nonzero())])
+
+        self.pending += 1
+        if self.pending >= self.batch_pages:
+            self.commit()
+
+    def commit(self):
+        """Finish the current batch of pages."""
+        self.connection.commit()
+        self.pending = 0
+
+    def close(self):
+        """Finish the current batch and close the database."""
+        self.commit()
+        self.connection.close()
+
+    def set_chart_date(self, file_name, chart, year, month):
+        """Set the year and month of a month grid."""
+        with self.connection:
+            self.connection.execute(
+                'UPDATE grid_rows SET year = ?, month = ? '
+                'WHERE file_name = ? AND chart = ?',
+                (year, month, file_name, chart))
+
+    def marked_rows(self, days=None, **filters):
+        """
+        Get the rows with a slash on any of the days.
+
+        For example, marked_rows(days=(10, 20), year=1985) gets the rows of
+        1985 with a slash on the 10th to the 20th. Returns (file name, chart,
+        row number) tuples.
+        """
+        clause, params = where(filters, days)
+        return self.connection.execute(
+            'SELECT DISTINCT grid_rows.file_name, grid_rows.chart, '
+            'grid_rows.row_no FROM marks '
+            'JOIN grid_rows ON grid_rows.id = marks.row_id '
+            f'{clause} ORDER BY 1, 2, 3', params).fetchall()
+
+    def count_marks(self, group_by=None, days=None, **filters):
+        """
+        Count the slashes that match the filters.
+
+        The counts may be grouped by any of the filter columns, like 'day' or
+        'file_name', and then a list of (group, count) tuples is returned.
+        """
+        clause, params = where(filters, days)
+        if not group_by:
+            return self.connection.execute(
+                'SELECT COUNT(*) FROM marks '
+                'JOIN grid_rows ON grid_rows.id = marks.row_id '
+                f'{clause}', params).fetchone()[0]
+
+        column = COLUMNS[group_by]
+        return self.connection.execute(
+            f'SELECT {column}, COUNT(*) FROM marks '
+            'JOIN grid_rows ON grid_rows.id = marks.row_id '
+            f'{clause} GROUP BY {column} ORDER BY {column}',
+            params).fetchall()
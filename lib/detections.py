@@ -0,0 +1,58 @@
+"""Remember what the detectors found in a grid's cells."""
+
+import hashlib
+
+from lib import instrument
+
+# The digest of each angle table, by the table's id. The tables are kept so
+# their ids are not reused.
+DIGESTS = {}
+
+
+def angles_digest(angles):
+    """
+    Get a short digest of an angle table.
+
+    Each table is only hashed the first time it is used, so building a key
+    does not copy the table.
+    """
+    entry = DIGESTS.get(id(angles))
+    if entry is None or entry[0] is not angles:
+        digest = hashlib.blake2b(angles.tobytes(), digest_size=16).digest()
+        entry = DIGESTS[id(angles)] = (angles, digest)
+    return entry[1]
+
+
+def detector_key(name, *params, angles=None):
+    """Build a store key for a detector and its parameters."""
+    return (name, angles_digest(angles) if angles is not None else None) + \
+        params
+
+
+class DetectionStore:
+    """
+    The detection results for one grid.
+
+    Results are keyed by the detector, its parameters, and the cell, so each
+    one is computed at most once however many times it is asked for. A new
+    store is made whenever the grid's cells are rebuilt.
+    """
+
+    def __init__(self):
+        """Start empty."""
+        self.results = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, compute):
+        """Get a result, computing it if it is not in the store yet."""
+        if key in self.results:
+            self.hits += 1
+            instrument.count('detection_hits')
+            return self.results[key]
+
+        self.misses += 1
+        instrument.count('detection_misses')
+        result = compute()
+        self.results[key] = result
+        return result
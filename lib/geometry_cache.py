@@ -0,0 +1,157 @@
+"""An on-disk cache of the grid geometry found on each page."""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from lib.cell import Cell
+from lib.grid import Grid
+from lib.grid_lines import GridLines
+from lib.layout_prior import LayoutPrior
+from lib.util import Crop
+
+# Change this when a change to the code changes the grid geometry
+VERSION = '3'
+
+
+def parameters():
+    """Get the parameters that change the grid geometry or labels."""
+    return {
+        'version': VERSION,
+        'split_limit': Grid.split_limit,
+        'tiles': Grid.tiles,
+        'tile_overlap': Grid.tile_overlap,
+        'ink_block_size': Grid.ink_block_size,
+        'ink_offset': Grid.ink_offset,
+        'ink_thinning': Grid.ink_thinning,
+        'engine': GridLines.engine,
+        'min_distance': GridLines.min_distance,
+        'near_horiz': GridLines.near_horiz.tolist(),
+        'near_vert': GridLines.near_vert.tolist(),
+        'strip_size': GridLines.strip_size,
+        'shears': GridLines.shears.tolist(),
+        'refine_shears': GridLines.refine_shears.tolist(),
+        'refine_band': GridLines.refine_band,
+        'coarse_size': GridLines.coarse_size,
+        'coarse_fill': GridLines.coarse_fill,
+        'layout_prior': LayoutPrior.enabled,
+        'prior_band': GridLines.prior_band,
+        'cell_crop': list(Cell.crop),
+        'label_fill': Cell.label_fill,
+        'min_ink': Cell.min_ink,
+        'slash_scan': Cell.slash_scan.tolist(),
+        'label_lines': Cell.label_lines.tolist(),
+    }
+
+
+def dump_grid(grid):
+    """Convert the grid geometry into something we can save as JSON."""
+    return {
+        'crop': list(grid.crop) if grid.crop else None,
+        'split': grid.split,
+        'horiz': grid.horiz.lines,
+        'vert': grid.vert.lines,
+        'row_labels': grid.row_labels,
+        'col_labels': grid.col_labels,
+        'bands': [dump_grid(band) for band in grid.bands],
+        'stitched': grid.stitched,
+    }
+
+
+def load_grid(parent, data):
+    """Rebuild a grid, and its sub-grids, from the saved geometry."""
+    crop = Crop(*data['crop']) if data['crop'] else None
+    grid = Grid(grid=parent, crop=crop, split=data['split'])
+    grid.horiz.lines = data['horiz']
+    grid.vert.lines = data['vert']
+    grid.row_labels = data['row_labels']
+    grid.col_labels = data['col_labels']
+    grid.bands = [load_grid(grid, band) for band in data['bands']]
+    grid.stitched = data['stitched']
+    return grid
+
+
+class GeometryCache:
+    """
+    Content addressed cache of grid geometry.
+
+    Entries are keyed by a hash of the page image and the line finding
+    parameters, so changing a parameter misses the old entries. Those are
+    eventually evicted, least recently used first, when the cache grows past
+    its size limit.
+    """
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024):
+        """Create the cache directory if needed."""
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(edges):
+        """Build the cache key for a page's ink map."""
+        digest = hashlib.sha256()
+        digest.update(str((edges.shape, edges.dtype.str)).encode())
+        digest.update(np.ascontiguousarray(edges).view(np.uint8))
+        digest.update(json.dumps(parameters(), sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def path(self, key):
+        """Get the path of a cache entry."""
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, key):
+        """Get the cache entry or None if it is not there."""
+        path = self.path(key)
+        try:
+            with open(path) as json_file:
+                data = json.load(json_file)
+        except (OSError, ValueError):
+            return None
+        os.utime(path)
+        return data
+
+    def put(self, key, data):
+        """Save a cache entry and evict old entries if we are too big."""
+        path = self.path(key)
+        temp_path = path + f'.{os.getpid()}.tmp'
+        with open(temp_path, 'w') as json_file:
+            json.dump(data, json_file, default=int)
+        os.replace(temp_path, path)
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until we fit."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(e[1] for e in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def get_geometry(self, key, grid):
+        """Get the left side and month grids for a page from the cache."""
+        data = self.get(key)
+        if not data:
+            return None, None
+        left_side = load_grid(grid, data['left_side'])
+        months = [load_grid(grid, m) for m in data['months']]
+        return left_side, months
+
+    def put_geometry(self, key, left_side, months):
+        """Save the left side and month grids for a page in the cache."""
+        self.put(key, {
+            'left_side': dump_grid(left_side),
+            'months': [dump_grid(m) for m in months],
+        })
@@ -2,11 +2,20 @@
 
 # pylint: disable=too-many-instance-attributes
 
+import numpy as np
 from skimage import io, util
+from skimage.morphology import thin
 
+from lib import instrument, threads
 from lib.cell import Cell
+from lib.cell_stack import has_lines
+from lib.cell_table import CellTable
+from lib.detections import DetectionStore, detector_key
+from lib.grid_lines import GridLines
 from lib.horizontal_lines import Horizontal
-from lib.util import Crop, Offset
+from lib.ink import ink_density, ink_map, spill_ink_map
+from lib.layout_prior import shift_lines
+from lib.util import Crop, Offset, tile_rows
 from lib.vertical_lines import Vertical
 
 
@@ -15,45 +24,123 @@ class Grid:
     Container for other classes.
 
     Contains horizontal and vertical grid lines as well as the grid cells.
+
+    Only the page level grid owns image buffers. They are read-only and every
+    sub-grid, and every cell, is a view into them plus an offset.
     """
 
+    # Grids with more horizontal lines than the split limit are cut into
+    # overlapping bands of rows. Zero tiles means one band for every half
+    # split limit of rows so tall grids get more bands.
     split_limit = 32
-
-    def __init__(self, *, file_name=None, grid=None, crop=None, split=False):
-        """Make a new gird from either an image file or another grid."""
-        if file_name:
-            self.image = io.imread(file_name)
+    tiles = 2
+    tile_overlap = 20
+
+    # The ink map is built once per page and shared with all sub-grids
+    ink_block_size = 0
+    ink_offset = 0.04
+    ink_thinning = False
+
+    # Large pages may keep their ink map in a memory mapped spill file in
+    # this directory. It is built in tiles of rows of about ink_tile_bytes.
+    # The page image itself is not spilled.
+    spill_dir = None
+    ink_tile_bytes = 64 * 2 ** 20
+
+    def __init__(self, *, file_name=None, image=None, grid=None, crop=None,
+                 split=False, owned=False):
+        """
+        Make a new gird from an image file, an image, or another grid.
+
+        An owned image, like one we read ourselves, may be overwritten.
+        """
+        self.crop = crop
+        if file_name or image is not None:
+            owned = owned or image is None
+            if image is None:
+                image = io.imread(file_name)
             self.offset = Offset(0, 0)
+
+            # Bilevel pages we read are inverted in place, and spilled pages
+            # are not kept. Both are rebuilt from the ink when needed. Only
+            # the line finders see the thinned ink. The cells and the QC
+            # image use all of it.
+            if self.spill_dir:
+                in_place = True
+                rows = tile_rows(image.shape[1], self.ink_tile_bytes)
+                self.edges = spill_ink_map(
+                    image,
+                    self.spill_dir,
+                    rows,
+                    block_size=self.ink_block_size,
+                    offset=self.ink_offset)
+                self.line_ink = spill_ink_map(
+                    image,
+                    self.spill_dir,
+                    rows,
+                    block_size=self.ink_block_size,
+                    offset=self.ink_offset,
+                    thinning=True) if self.ink_thinning else self.edges
+            else:
+                in_place = owned and image.dtype == bool
+                self.edges = ink_map(
+                    image,
+                    block_size=self.ink_block_size,
+                    offset=self.ink_offset,
+                    overwrite=in_place)
+                self.line_ink = thin(self.edges) if self.ink_thinning \
+                    else self.edges
+            self.edges.setflags(write=False)
+            self.line_ink.setflags(write=False)
+
+            self._image = None if in_place else image.view()
+            if self._image is not None:
+                self._image.setflags(write=False)
         elif grid:
-            self.image = grid.image
+            self._image = grid._image  # pylint: disable=protected-access
+            self.edges = grid.edges
+            self.line_ink = grid.line_ink
             self.offset = grid.offset
             if crop:
-                self.image = util.crop(
-                    self.image,
-                    ((crop.top, crop.bottom), (crop.left, crop.right)))
+                crop_width = ((crop.top, crop.bottom), (crop.left, crop.right))
+                self.edges = util.crop(self.edges, crop_width)
+                self.line_ink = util.crop(self.line_ink, crop_width)
+                if self._image is not None:
+                    self._image = util.crop(self._image, crop_width)
                 self.offset = Offset(x=self.offset.x + crop.left,
                                      y=self.offset.y + crop.top)
 
-        self.edges = util.invert(self.image)
-
-        self.horiz = Horizontal(self.edges)
-        self.vert = Vertical(self.edges)
+        self.horiz = Horizontal(self.line_ink)
+        self.vert = Vertical(self.line_ink)
 
         self.rows = None
 
         self.cells = []
+        self.store = DetectionStore()
         self.row_labels = []
         self.col_labels = []
+        self.slashes = None
 
-        self.top = None
-        self.bottom = None
+        self.bands = []
+        self.stitched = []
         self.split = split
-        self.mid_point = 999
 
     @property
     def header_row(self):
         """Return the row with the column headers."""
-        return self.top.header_row if self.top else self.cells[0]
+        return self.bands[0].header_row if self.bands else self.cells[0]
+
+    @property
+    def image(self):
+        """Get the grid's image. Bilevel images are rebuilt from the ink."""
+        if self._image is None:
+            return np.logical_not(self.edges)
+        return self._image
+
+    @property
+    def ink_density(self):
+        """Get the fraction of the grid's pixels that vote for lines."""
+        return ink_density(self.line_ink)
 
     @property
     def width(self):
@@ -65,83 +152,111 @@ class Grid:
         """Make it easy to get the image height."""
         return self.vert.size
 
-    def find_grid_lines(self):
-        """Find horizontal and vertical grid lines."""
+    def find_grid_lines(self, prior=None):
+        """
+        Find horizontal and vertical grid lines.
+
+        The prior is the page layout of the lines we expect to find. It is
+        given in page coordinates.
+        """
+        if prior:
+            offset = Offset(x=-self.offset.x, y=-self.offset.y)
+            self.horiz.prior = shift_lines(prior['horiz'], offset)
+            self.vert.prior = shift_lines(prior['vert'], offset)
+
         self.horiz.find_grid_lines()
         self.vert.find_grid_lines()
 
         if self.split and len(self.horiz.lines) > self.split_limit:
-            self.mid_point = int(len(self.horiz.lines) / 2)
-            point1, _ = self.horiz.lines[self.mid_point]
-            split = point1[1]
-
-            self.top = Grid(
-                grid=self,
-                crop=Crop(top=0,
-                          bottom=self.height - split - 20,
-                          left=0,
-                          right=0))
-            self.top.find_grid_lines()
-
-            self.bottom = Grid(
-                grid=self,
-                crop=Crop(top=split - 20,
-                          bottom=0,
-                          left=0,
-                          right=0))
-            self.bottom.find_grid_lines()
-            if len(self.bottom.vert.lines) != len(self.top.vert.lines):
-                self.bottom = None
+            self.find_band_lines(prior['bands'] if prior else None)
+
+    def band_count(self):
+        """Get the number of bands to cut the grid into."""
+        rows = len(self.horiz.lines) - 1
+        tiles = self.tiles or -(-rows // (self.split_limit // 2))
+        return max(1, min(tiles, rows))
+
+    def find_band_lines(self, priors=None):
+        """
+        Cut the grid into overlapping bands of rows and find their lines.
+
+        Neighboring bands share a horizontal line. The bands' vertical lines
+        are stitched together into piecewise linear lines.
+        """
+        count = self.band_count()
+        edges = [int(i * len(self.horiz.lines) / count)
+                 for i in range(1, count)]
+        splits = [self.horiz.lines[i][0][1] for i in edges]
+
+        tops = [0] + [split - self.tile_overlap for split in splits]
+        bottoms = [self.height - split - self.tile_overlap
+                   for split in splits] + [0]
+        self.bands = [
+            Grid(grid=self, crop=Crop(top=top, bottom=bottom, left=0, right=0))
+            for top, bottom in zip(tops, bottoms)]
+
+        if not priors or len(priors) != count:
+            priors = [None] * count
+        threads.map_ordered(lambda bp: bp[0].find_grid_lines(bp[1]),
+                            zip(self.bands, priors))
+
+        self.stitch_bands()
+
+    def stitch_bands(self):
+        """
+        Give every band the same vertical lines as the band above it.
+
+        When a band finds a different number of vertical lines, its lines are
+        matched to the lines of the band above where the bands meet. Lines
+        missing from the band continue the line above and extra lines are
+        dropped.
+        """
+        self.stitched = []
+        for idx in range(1, len(self.bands)):
+            above, band = self.bands[idx - 1], self.bands[idx]
+            if len(band.vert.lines) == len(above.vert.lines):
+                continue
+            band.vert.lines = continue_lines(
+                above.vert.lines, band.vert.lines,
+                band.offset.y - above.offset.y, band.height)
+            self.stitched.append(idx)
+            instrument.count('bands_stitched')
 
     def get_cells(self):
-        """Build the grid cells from the grid lines."""
-        top_cells = []
-        bottom_cells = []
-        cells = []
-
-        for row_idx, (top, bottom) in enumerate(zip(self.horiz.lines[:-1],
-                                                    self.horiz.lines[1:])):
-            if row_idx < self.mid_point:
-                cells = top_cells
-            elif row_idx >= self.mid_point:
-                cells = bottom_cells
-
-            cells.append([])
-            for (left, right) in zip(
-                    self.vert.lines[:-1], self.vert.lines[1:]):
-                cells[-1].append(Cell(self, top, bottom, left, right))
-
-        if self.top:
-            self.top.get_cells()
-            top_cells = self.top.cells
-        if self.bottom:
-            self.bottom.get_cells()
-            bottom_cells = self.bottom.cells
-
-        self.cells = top_cells + bottom_cells
+        """
+        Build the grid cells from the grid lines.
+
+        The cells are kept in a cell table and each row of cells is a view
+        into it. When the grid is cut into bands the rows come from the bands'
+        tables instead.
+        """
+        self.store = DetectionStore()
+        if self.bands:
+            threads.map_ordered(Grid.get_cells, self.bands)
+            self.cells = [row for band in self.bands for row in band.cells]
+            return
+
+        table = CellTable(self, self.horiz.lines, self.vert.lines)
+        self.cells = table.rows()
+        instrument.count('cells_built', table.size)
 
     def vert_add_line(self, point1, point2):
         """Add a vertical line to the grid."""
         self.vert.add_line(point1, point2)
-        if self.top:
-            self.top.vert.add_line(point1, (point2[0], self.top.vert.size))
-        if self.bottom:
-            self.bottom.vert.add_line(
-                point1, (point2[0], self.bottom.vert.size))
+        for band in self.bands:
+            band.vert.add_line(point1, (point2[0], band.vert.size))
 
     def vert_insert_line(self, line_idx, distance=-50):
         """Insert a vertical grid line relative to another line."""
         self.vert.insert_line(self.vert.lines[line_idx], distance=distance)
-        if self.top:
-            self.top.vert.insert_line(
-                self.top.vert.lines[line_idx], distance=distance)
-        if self.bottom:
-            self.bottom.vert.insert_line(
-                self.bottom.vert.lines[line_idx], distance=distance)
+        for band in self.bands:
+            band.vert.insert_line(
+                band.vert.lines[line_idx], distance=distance)
 
     def get_row_labels(self):
         """Get row labels for the cells."""
-        self.row_labels = [row[0].is_label() for row in self.cells]
+        self.row_labels = threads.map_chunks(
+            lambda row: row[0].is_label(), self.cells)
 
         # Remove isolated labels
         for i in range(2, len(self.row_labels) - 3):
@@ -150,16 +265,57 @@ class Grid:
                 self.row_labels[i] = True
 
     def get_col_labels(self):
-        """Get column labels for the cells."""
-        labels = [cell.is_label() for cell in self.header_row]
+        """
+        Get column labels for the cells.
+
+        The slashes are found first so the first column is checked with the
+        same scan that finds the slashes.
+        """
+        labels = threads.map_chunks(
+            lambda cell: cell.is_label(), self.header_row)
 
         first_label = [i for i, val in enumerate(labels) if val][0]
 
         # The first column is not a header if there are no values in it
-        labels[first_label] = sum([len(row[first_label].has_line(
-            Cell.forward_slashes)) for row in self.cells[1:]]) > 0
+        self.get_slashes()
+        labels[first_label] = bool(
+            self.slashes[:, first_label:first_label + 1].any())
 
         # Set the first 31 columns to be a label
         first_label = [i for i, val in enumerate(labels) if val][0]
         self.col_labels = [(first_label <= i < first_label + 31)
                            for i, _ in enumerate(labels)]
+
+    def get_slashes(self):
+        """
+        Find the cells with forward slashes.
+
+        All cells below the header row are scanned in one batched pass. The
+        result is a boolean matrix indexed by [row - 1][column].
+        """
+        self.slashes = self.store.get(
+            detector_key('slashes', Cell.crop, angles=Cell.slash_scan),
+            lambda: has_lines(
+                self.cells[1:], Cell.slash_scan, crop=Cell.crop))
+
+
+def continue_lines(above, lines, top, height):
+    """
+    Match a band's vertical lines to the lines of the band above it.
+
+    The band starts at top in the coordinates of the band above. Each line
+    above is matched to the closest of the band's lines where the bands meet,
+    or continued into the band when there is no line close enough.
+    """
+    matched = []
+    for (x0, y0), (x1, y1) in above:
+        slope = (x1 - x0) / (y1 - y0)
+        x = x0 + (top - y0) * slope
+        near = [ln for ln in lines
+                if abs(ln[0][0] - x) < GridLines.min_distance]
+        if near:
+            matched.append(min(near, key=lambda ln: abs(ln[0][0] - x)))
+        else:
+            matched.append([[int(round(x)), 0],
+                            [int(round(x + height * slope)), height]])
+    return matched
@@ -6,7 +6,58 @@
 import numpy as np
 from skimage.transform import hough_line, hough_line_peaks
 
-from lib.util import too_close
+from lib import instrument
+from lib.util import close_neighbors, tile_rows
+
+
+def downsample(image, factor, fill=0.25):
+    """
+    Shrink the ink map by an integer factor.
+
+    A coarse pixel is ink when at least the fill fraction of its block is ink.
+    A line crossing the block fills about the same fraction of it at any scan
+    resolution, so lines survive but scattered specks of ink do not.
+    """
+    if factor == 1:
+        return image
+    height = image.shape[0] // factor
+    width = image.shape[1] // factor
+    image = image[:height * factor, :width * factor].view(np.uint8)
+
+    # Strided adds are much faster than summing over a reshaped block axis
+    rows = image[0::factor].astype(np.uint16)
+    for i in range(1, factor):
+        rows += image[i::factor]
+    blocks = rows[:, 0::factor].copy()
+    for i in range(1, factor):
+        blocks += rows[:, i::factor]
+
+    return blocks >= factor * factor * fill
+
+
+def tiled_hough_line(image, thetas, rows):
+    """
+    Get the Hough Transform of the image one tile of rows at a time.
+
+    This is the same accumulator as skimage's hough_line, but only one tile's
+    ink pixels are in memory at a time. The tiles of a memory mapped image are
+    read as they are needed.
+    """
+    height, width = image.shape
+    offset = int(np.ceil(np.sqrt(height * height + width * width)))
+    size = 2 * offset + 1
+    cos, sin = np.cos(thetas), np.sin(thetas)
+
+    accumulator = np.zeros((len(thetas), size), dtype=np.uint64)
+    for top in range(0, height, rows):
+        y, x = np.nonzero(image[top:top + rows])
+        y += top
+        for votes, cos_theta, sin_theta in zip(accumulator, cos, sin):
+            rhos = np.round(cos_theta * x + sin_theta * y).astype(np.intp)
+            votes += np.bincount(rhos + offset, minlength=size).astype(
+                np.uint64)
+
+    return accumulator.T, thetas, np.linspace(-offset, offset, size)
 
 
 class GridLines:
@@ -14,6 +65,34 @@ class GridLines:
 
     min_distance = 40
 
+    # A line needs votes from this fraction of the image's length. Thinned
+    # ink has one pixel wide lines with a third to two thirds of the votes,
+    # so they need half as many.
+    line_fraction = 0.4
+    thinned = False
+
+    # The line finding engine is 'hough', 'profile', or 'coarse'
+    engine = 'hough'
+
+    # The coarse engine shrinks the image to about this many pixels on its
+    # longest side so the work does not grow with the scan resolution
+    coarse_size = 1024
+    coarse_fill = 1 / 6
+
+    # How far, in pixels, a line may move from its prior position
+    prior_band = 8
+
+    # The Hough Transform votes in tiles of rows of about this many bytes.
+    # Zero votes with the whole image at once.
+    tile_bytes = 0
+
+    # Projection profiles are summed in strips along the lines and then
+    # shifted to get the profile at each shear angle (in degrees)
+    strip_size = 64
+    shears = np.linspace(-2.0, 2.0, num=41)
+    refine_shears = np.linspace(-0.1, 0.1, num=11)
+    refine_band = 3
+
     near_horiz = np.deg2rad(np.linspace(-2.0, 2.0, num=41))
     near_vert = np.deg2rad(np.linspace(88.0, 92.0, num=41))
 
@@ -29,9 +108,46 @@ class GridLines:
         self.lines = []
         self.threshold = 500
 
+        # The lines found by the line finder and the lines we expect to find
+        self.found = []
+        self.prior = None
+
+    def size_threshold(self):
+        """Get the votes a line needs from the image's length."""
+        fraction = self.line_fraction / 2 if self.thinned else \
+            self.line_fraction
+        return self.size * fraction
+
     def find_lines(self):
+        """
+        Find the grid lines with the selected engine.
+
+        If we have a prior for the lines we try that first. It is rejected if
+        this page has lines that the prior does not.
+        """
+        if self.prior:
+            if self.find_prior_lines() and not self.has_unexpected_lines():
+                instrument.count('prior_accepted')
+                return
+            instrument.count('prior_rejected')
+
+        if self.engine == 'profile':
+            self.find_profile_lines()
+        elif self.engine == 'coarse':
+            self.find_coarse_lines()
+        else:
+            self.find_hough_lines()
+
+    def find_hough_lines(self):
         """Find the grid lines using the Hough Transform."""
-        h_matrix, h_angles, h_dist = hough_line(self.image, self.thetas)
+        with instrument.stage('hough_line'):
+            if self.tile_bytes:
+                rows = tile_rows(self.image.shape[1], self.tile_bytes)
+                h_matrix, h_angles, h_dist = tiled_hough_line(
+                    self.image, self.thetas, rows)
+            else:
+                h_matrix, h_angles, h_dist = hough_line(
+                    self.image, self.thetas)
 
         _, self.angles, self.dists = hough_line_peaks(
             h_matrix,
@@ -40,6 +156,202 @@ class GridLines:
             threshold=self.threshold,
             min_distance=self.min_distance)
 
+    def strip_profiles(self):
+        """Get the ink projection profile of each strip along the lines."""
+        raise NotImplementedError
+
+    def ink_coords(self, low, high, stride=1):
+        """
+        Get ink pixel coordinates, across and along the lines, in a band.
+
+        Only every stride-th pixel along the lines is used.
+        """
+        raise NotImplementedError
+
+    def shear2polar(self, shear, offset):
+        """Convert a sheared line to the Hough Transform's polar form."""
+        raise NotImplementedError
+
+    def polar2shear(self, theta, rho):
+        """Convert a line in the Hough Transform's polar form to a shear."""
+        raise NotImplementedError
+
+    def line2shear(self, line):
+        """Convert a line given by its end points to a shear."""
+        raise NotImplementedError
+
+    def shear_profiles(self, shears):
+        """
+        Get the projection profile for each shear angle.
+
+        Each strip profile is shifted by the drift of a sheared line at the
+        middle of the strip and then the strips are summed. The result is
+        indexed by [offset + pad, shear] like a Hough Transform accumulator.
+        """
+        profiles = self.strip_profiles()
+        count, length = profiles.shape
+
+        middles = (np.arange(count) + 0.5) * self.strip_size
+        shifts = np.round(np.outer(np.tan(shears), middles)).astype(np.intp)
+        pad = int(np.abs(shifts).max(initial=0))
+
+        padded = np.pad(profiles, ((0, 0), (2 * pad, 2 * pad)))
+        size = length + 2 * pad
+
+        accumulator = np.zeros((len(shears), size), dtype=np.intp)
+        for profile, strip_shifts in zip(padded, shifts.T + pad):
+            for i, shift in enumerate(strip_shifts):
+                accumulator[i] += profile[shift:shift + size]
+
+        return accumulator.T, pad
+
+    def refine_line(self, shear, offset, band=None, stride=1):
+        """
+        Refine a candidate line using the ink pixels near it.
+
+        The ink in a narrow band around the line is projected at finer shear
+        angles and the strongest line near the candidate offset wins. The band
+        may be sampled every stride pixels along the line. Returns the shear,
+        the offset, and the votes for the line.
+        """
+        band = band or self.refine_band
+        drift = self.size * np.tan(shear)
+        low = int(min(offset, offset + drift)) - 2 * band
+        high = int(max(offset, offset + drift)) + 2 * band + 1
+        across, along = self.ink_coords(max(0, low), max(0, high), stride)
+
+        fines = shear + np.deg2rad(self.refine_shears)
+        offsets = np.round(across - np.outer(np.tan(fines), along))
+        offsets = offsets.astype(np.intp) - offset + band
+
+        width = 2 * band + 1
+        rows = np.broadcast_to(np.arange(len(fines))[:, np.newaxis],
+                               offsets.shape)
+        near = (offsets >= 0) & (offsets < width)
+        votes = np.bincount(rows[near] * width + offsets[near],
+                            minlength=len(fines) * width)
+
+        best = votes.argmax()
+        return (fines[best // width], offset + best % width - band,
+                votes[best] * stride)
+
+    @instrument.timed
+    def find_profile_lines(self):
+        """
+        Find the grid lines using projection profiles.
+
+        Peaks in the projection profiles of the ink, across a small set of
+        shear angles, are the candidate lines. Each candidate is then refined
+        locally. The lines are returned in the same polar form as the Hough
+        Transform.
+        """
+        shears = np.deg2rad(self.shears)
+        accumulator, pad = self.shear_profiles(shears)
+
+        _, peak_shears, peak_offsets = hough_line_peaks(
+            accumulator,
+            shears,
+            np.arange(accumulator.shape[0]) - pad,
+            threshold=self.threshold,
+            min_distance=self.min_distance)
+
+        self.angles, self.dists = [], []
+        for shear, offset in zip(peak_shears, peak_offsets):
+            shear, offset, _ = self.refine_line(shear, int(offset))
+            theta, rho = self.shear2polar(shear, offset)
+            self.angles.append(theta)
+            self.dists.append(rho)
+
+    @instrument.timed
+    def find_coarse_lines(self):
+        """
+        Find the grid lines on a shrunken image and then refine them.
+
+        The Hough Transform finds candidate lines on a downsampled image. Its
+        threshold follows the image size and the minimum distance is scaled
+        down with it. Each candidate is then refined at full resolution in a
+        band that is widened by a coarse pixel. The band is sampled at the
+        coarse pixel spacing along the line so that the refinement only grows
+        with the band width. Like the prior, candidates that do not get as
+        many votes at full resolution as a Hough Transform peak needs are
+        dropped.
+        """
+        factor = max(1, max(self.image.shape) // self.coarse_size)
+
+        coarse = type(self)(
+            downsample(self.image, factor, fill=self.coarse_fill))
+        coarse.min_distance = max(1, round(self.min_distance / factor))
+        coarse.find_hough_lines()
+
+        self.angles, self.dists = [], []
+        for theta, rho in zip(coarse.angles, coarse.dists):
+            shear, offset = coarse.polar2shear(theta, rho)
+            offset = int(round(offset * factor + (factor - 1) / 2))
+            shear, offset, votes = self.refine_line(
+                shear, offset, band=self.refine_band + factor, stride=factor)
+            if votes < self.threshold:
+                continue
+            theta, rho = self.shear2polar(shear, offset)
+            self.angles.append(theta)
+            self.dists.append(rho)
+
+    @instrument.timed
+    def find_prior_lines(self):
+        """
+        Find the grid lines near where the prior says they are.
+
+        Each expected line is refined in a band around it. The prior is
+        rejected if any line falls outside of the image or does not get as
+        many votes as a Hough Transform peak needs.
+        """
+        angles, dists = [], []
+        across = self.image.shape[0] + self.image.shape[1] - self.size
+        for line in self.prior:
+            shear, offset = self.line2shear(line)
+            offset = int(round(offset))
+            if not 0 <= offset < across:
+                return False
+            shear, offset, votes = self.refine_line(
+                shear, offset, band=self.prior_band)
+            if votes < self.threshold:
+                return False
+            theta, rho = self.shear2polar(shear, offset)
+            angles.append(theta)
+            dists.append(rho)
+
+        self.angles, self.dists = angles, dists
+        return True
+
+    @instrument.timed
+    def has_unexpected_lines(self):
+        """
+        Look for lines that are not near any of the prior's lines.
+
+        All of the ink is projected once at the mean shear of the lines from
+        the prior, and its peaks are picked like the Hough Transform's. A peak
+        that is farther than the minimum distance from every line is a line
+        the previous page did not have.
+        """
+        shears, offsets = zip(*[self.polar2shear(theta, rho) for theta, rho
+                                in zip(self.angles, self.dists)])
+        shear = np.mean(shears)
+        across = self.image.shape[0] + self.image.shape[1] - self.size
+        coords, along = self.ink_coords(0, across)
+
+        pad = int(np.ceil(abs(np.tan(shear)) * self.size))
+        projected = np.round(coords - np.tan(shear) * along).astype(np.intp)
+        votes = np.bincount(projected + pad, minlength=across + 2 * pad)
+
+        _, _, peaks = hough_line_peaks(
+            votes[:, np.newaxis],
+            np.array([shear]),
+            np.arange(len(votes)) - pad,
+            threshold=self.threshold,
+            min_distance=self.min_distance)
+        expected = np.array(offsets)
+        return any(np.abs(expected - peak).min() > self.min_distance
+                   for peak in peaks)
+
     def polar2endpoints(self, theta, rho):
         """
         Convert a line given in polar coordinates to line segment end points.
@@ -60,6 +372,28 @@ class GridLines:
 
         return [x0, y0], [x1, y1]
 
+    def endpoints(self, thetas, rhos):
+        """
+        Convert lines in polar coordinates to line segment end points.
+
+        This is polar2endpoints() for an array of lines. The result is indexed
+        by [line, point, x or y].
+        """
+        thetas, rhos = np.asarray(thetas), np.asarray(rhos)
+        height, width = self.image.shape[:2]
+        cos, sin = np.cos(thetas), np.sin(thetas)
+        horiz = np.abs(thetas) > np.pi / 4
+        zeros = np.zeros(len(thetas))
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x0 = np.where(horiz, zeros, np.round(rhos / cos))
+            x1 = np.where(horiz, width, np.round((rhos - height * sin) / cos))
+            y0 = np.where(horiz, np.round(rhos / sin), zeros)
+            y1 = np.where(horiz, np.round((rhos - width * cos) / sin), height)
+
+        points = np.stack([x0, y0, x1, y1], axis=-1).astype(int)
+        return points.reshape(-1, 2, 2)
+
     def add_line(self, point1, point2):
         """Add a line to the list of lines."""
         self.lines.append((point1, point2))
@@ -78,14 +412,10 @@ class GridLines:
         """Find, convert, and sort the grid lines."""
         self.find_lines()
 
-        self.lines = [self.polar2endpoints(theta, rho)
-                      for (theta, rho) in zip(self.angles, self.dists)]
+        self.lines = self.endpoints(self.angles, self.dists).tolist()
 
         self.sort_lines()
 
-        lines = [self.lines[0]]
-        for ln1, ln2 in zip(self.lines[:-1], self.lines[1:]):
-            if not too_close(ln1, ln2):
-                lines.append(ln2)
-
-        self.lines = lines
+        close = close_neighbors(self.lines)
+        self.lines = [ln for ln, c in zip(self.lines, close) if not c]
+        self.found = list(self.lines)
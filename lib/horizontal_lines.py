@@ -1,5 +1,7 @@
 """Contains logic that is unique to the horizontal grid lines."""
 
+import numpy as np
+
 from lib.grid_lines import GridLines
 
 
@@ -11,7 +13,32 @@ class Horizontal(GridLines):
         super().__init__(image)
         self.size = image.shape[1]
         self.thetas = self.near_horiz
-        self.threshold = self.size * 0.4
+        self.threshold = self.size_threshold()
+
+    def strip_profiles(self):
+        """Horizontal lines run along the x-axis."""
+        starts = np.arange(0, self.size, self.strip_size)
+        return np.add.reduceat(self.image, starts, axis=1, dtype=np.intp).T
+
+    def ink_coords(self, low, high, stride=1):
+        """Horizontal lines run along the x-axis."""
+        y, x = np.nonzero(self.image[low:high, ::stride])
+        return y + low, x * stride
+
+    def shear2polar(self, shear, offset):
+        """Convert the line y = offset + x * tan(shear) to polar form."""
+        return np.pi / 2 + shear, offset * np.cos(shear)
+
+    def polar2shear(self, theta, rho):
+        """Convert a polar line to the form y = offset + x * tan(shear)."""
+        shear = theta - np.pi / 2
+        return shear, rho / np.cos(shear)
+
+    def line2shear(self, line):
+        """Convert a line to the form y = offset + x * tan(shear)."""
+        (x0, y0), (x1, y1) = line
+        shear = np.arctan2(y1 - y0, x1 - x0)
+        return shear, y0 - x0 * np.tan(shear)
 
     def insert_line(self, from_this_line, distance=-50):
         """Insert a horizontal grid line relative to another line."""
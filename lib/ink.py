@@ -0,0 +1,149 @@
+"""Convert page images into sparse boolean ink maps."""
+
+import os
+import tempfile
+
+import numpy as np
+from skimage.color import rgb2gray
+from skimage.filters import threshold_local, threshold_otsu
+from skimage.morphology import thin
+
+
+# Thinning only moves the ink a few pixels, so tiles that overlap by this
+# many rows thin the same way the whole page does
+THIN_HALO = 32
+
+
+def ink_map(image, block_size=0, offset=0.04, thinning=False,
+            overwrite=False, threshold=None):
+    """
+    Convert a page image into a boolean map of the ink pixels.
+
+    Bilevel scans are just inverted. Grey scale scans are thresholded, either
+    globally with Otsu's method or, when there is a block size, with a local
+    adaptive threshold. Otsu's threshold is the darkest paper value, so the
+    ink is at or below it. The local threshold is the mean of the block less
+    the offset, a fraction of the intensity range, and the ink must be darker
+    than that, so flat paper is not ink. Only ink pixels vote in the Hough
+    Transforms so this is much faster than voting with every pixel of the
+    paper. Thinning the
+    ink to one pixel wide strokes removes even more votes. Bilevel scans may
+    be inverted in place so we don't hold two copies of the page. A global
+    threshold may be given instead of using Otsu's method.
+    """
+    if image.dtype == bool:
+        ink = np.logical_not(image, out=image if overwrite else None)
+    else:
+        image = gray(image)
+        if block_size:
+            threshold = threshold_local(
+                image, block_size, offset=offset * intensity_range(image))
+            ink = image < threshold
+        else:
+            if threshold is None:
+                threshold = otsu_threshold(image)
+            ink = image <= threshold
+
+    if thinning:
+        ink = thin(ink)
+
+    return ink
+
+
+def gray(image):
+    """Get the grey scale version of a colour image."""
+    return rgb2gray(image[..., :3]) if image.ndim == 3 else image
+
+
+def intensity_range(image):
+    """Get the brightest value for the image's type. Floats go up to 1."""
+    if np.issubdtype(image.dtype, np.integer):
+        return np.iinfo(image.dtype).max
+    return 1.0
+
+
+def otsu_threshold(image):
+    """
+    Get Otsu's threshold for a grey scale image.
+
+    A flat image is blank paper, so its threshold is below all of its pixels.
+    """
+    low, high = image.min(), image.max()
+    if low == high:
+        return flat_threshold(low)
+    return threshold_otsu(image)
+
+
+def flat_threshold(value):
+    """Get a threshold below the only value of a flat image."""
+    if np.issubdtype(np.asarray(value).dtype, np.integer):
+        return int(value) - 1
+    return np.nextafter(value, -np.inf)
+
+
+def tiled_otsu(image, tile_rows):
+    """
+    Get Otsu's threshold for the page from the histograms of its tiles.
+
+    The histogram is binned the same way as for the whole page, so the
+    threshold is the same.
+    """
+    tiles = range(0, image.shape[0], tile_rows)
+    low = min(gray(image[top:top + tile_rows]).min() for top in tiles)
+    high = max(gray(image[top:top + tile_rows]).max() for top in tiles)
+    if low == high:
+        return flat_threshold(low)
+
+    if np.issubdtype(gray(image[:1]).dtype, np.integer):
+        low, high = int(low), int(high)
+        centers = np.arange(low, high + 1)
+        counts = sum(np.bincount(
+            (gray(image[top:top + tile_rows]) - low).ravel(),
+            minlength=len(centers)) for top in tiles)
+    else:
+        edges = np.histogram_bin_edges([], bins=256, range=(low, high))
+        centers = (edges[:-1] + edges[1:]) / 2
+        counts = sum(np.histogram(
+            gray(image[top:top + tile_rows]), bins=edges)[0] for top in tiles)
+
+    return threshold_otsu(hist=(counts, centers))
+
+
+def spill_ink_map(image, spill_dir, tile_rows, block_size=0, offset=0.04,
+                  thinning=False):
+    """
+    Build the ink map in a memory mapped spill file, one tile at a time.
+
+    Only a tile of rows is converted at a time and the ink map is kept in the
+    file, so the operating system can page it out instead of holding the
+    whole page in memory. The tiles overlap so the local threshold and the
+    thinning see the same neighborhood as on the whole page. The file is
+    removed as soon as it is mapped, so it goes away with the ink map.
+    """
+    height, width = image.shape[:2]
+    handle, path = tempfile.mkstemp(suffix='.npy', dir=spill_dir)
+    os.close(handle)
+    ink = np.lib.format.open_memmap(
+        path, mode='w+', dtype=bool, shape=(height, width))
+    os.remove(path)
+
+    threshold = None
+    if image.dtype != bool and not block_size:
+        threshold = tiled_otsu(image, tile_rows)
+
+    halo = block_size + (THIN_HALO if thinning else 0)
+    for top in range(0, height, tile_rows):
+        low = max(0, top - halo)
+        tile = ink_map(image[low:top + tile_rows + halo],
+                       block_size=block_size,
+                       offset=offset,
+                       thinning=thinning,
+                       threshold=threshold)
+        ink[top:top + tile_rows] = tile[top - low:top - low + tile_rows]
+
+    return ink
+
+
+def ink_density(ink):
+    """Get the fraction of pixels that are ink."""
+    return np.count_nonzero(ink) / ink.size if ink.size else 0.0
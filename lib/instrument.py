@@ -0,0 +1,192 @@
+"""Opt-in timing and counting of the pipeline's hot paths."""
+
+import functools
+import resource
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from time import perf_counter
+
+
+class Recorder:
+    """
+    Collect the measurements for the page being processed.
+
+    All of the recording functions do nothing until the recorder is enabled,
+    so the instrumentation can stay in the hot paths.
+    """
+
+    enabled = False
+
+    def __init__(self):
+        """Start with no page."""
+        self.lock = threading.Lock()
+        self.page = None
+        self.start = 0.0
+        self.times = Counter()
+        self.calls = Counter()
+        self.counts = Counter()
+
+    def start_page(self, page_id):
+        """Start recording a new page."""
+        if not self.enabled:
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        self.page = page_id
+        self.times, self.calls, self.counts = Counter(), Counter(), Counter()
+        self.start = perf_counter()
+
+    def end_page(self):
+        """Stop recording the page and return its record."""
+        if not self.enabled or self.page is None:
+            return None
+        record = {
+            'page': self.page,
+            'wall_time': perf_counter() - self.start,
+            'stages': dict(self.times),
+            'calls': dict(self.calls),
+            'counts': dict(self.counts),
+            'peak_memory': tracemalloc.get_traced_memory()[1],
+            'max_rss': resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss * 1024,
+        }
+        self.page = None
+        return record
+
+    def add_time(self, name, seconds):
+        """Add the time for one call of a stage."""
+        with self.lock:
+            self.times[name] += seconds
+            self.calls[name] += 1
+
+    def count(self, name, value=1):
+        """Add to a counter."""
+        if self.enabled:
+            with self.lock:
+                self.counts[name] += value
+
+
+RECORDER = Recorder()
+
+
+def enable(enabled=True):
+    """Turn the instrumentation on or off."""
+    Recorder.enabled = enabled
+
+
+def is_enabled():
+    """Is the instrumentation on."""
+    return Recorder.enabled
+
+
+def start_page(page_id):
+    """Start recording a new page."""
+    RECORDER.start_page(page_id)
+
+
+def end_page():
+    """Stop recording the page and return its record."""
+    return RECORDER.end_page()
+
+
+def count(name, value=1):
+    """Add to a counter."""
+    RECORDER.count(name, value)
+
+
+@contextmanager
+def stage(name):
+    """Time a stage of the pipeline."""
+    if not Recorder.enabled:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        RECORDER.add_time(name, perf_counter() - start)
+
+
+def timed(func):
+    """Time every call to the function."""
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not Recorder.enabled:
+            return func(*args, **kwargs)
+        start = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            RECORDER.add_time(name, perf_counter() - start)
+
+    return wrapper
+
+
+def summarize(records, top=5):
+    """Get summary lines for the slowest pages and stages."""
+    records = [r for r in records if r]
+    if not records:
+        return []
+
+    lines = [f'Slowest pages (of {len(records)}):']
+    for record in sorted(records, key=lambda r: -r['wall_time'])[:top]:
+        lines.append(f"  {record['wall_time']:8.3f}s  {record['page']}")
+
+    times, calls = Counter(), Counter()
+    for record in records:
+        times.update(record['stages'])
+        calls.update(record['calls'])
+
+    lines.append('Slowest stages (total time, calls):')
+    for name, seconds in times.most_common(top * 2):
+        lines.append(f'  {seconds:8.3f}s  {calls[name]:8d}  {name}')
+
+    counts = Counter()
+    for record in records:
+        counts.update(record['counts'])
+    if counts['line_tests']:
+        skipped = counts['line_tests_skipped']
+        lines.append(
+            f"Line tests skipped by the ink prefilter: {skipped} of "
+            f"{counts['line_tests']} "
+            f"({skipped / counts['line_tests']:.1%})")
+
+    if counts['label_tests']:
+        lines.append(
+            f"Labels accepted by the fill test: {counts['labels_by_fill']} "
+            f"of {counts['label_tests']} "
+            f"({counts['labels_by_fill'] / counts['label_tests']:.1%})")
+
+    densities = [r['counts']['ink_pixels'] / r['counts']['page_pixels']
+                 for r in records if r['counts'].get('page_pixels')]
+    if densities:
+        lines.append(
+            f"Ink density: {counts['ink_pixels'] / counts['page_pixels']:.2%}"
+            f" of all pixels, {min(densities):.2%} to {max(densities):.2%}"
+            f" per page")
+
+    tried = counts['prior_accepted'] + counts['prior_rejected']
+    if tried:
+        lines.append(
+            f"Layout prior accepted: {counts['prior_accepted']} of {tried} "
+            f"line searches ({counts['prior_accepted'] / tried:.1%})")
+
+    if counts['detection_misses']:
+        lines.append(
+            f"Detection store: {counts['detection_hits']} hits, "
+            f"{counts['detection_misses']} misses")
+
+    latencies = sorted(r['latency'] for r in records if 'latency' in r)
+    if latencies:
+        lines.append(
+            f'Arrival to CSV latency: median '
+            f'{latencies[len(latencies) // 2]:.3f}s, max {latencies[-1]:.3f}s')
+
+    peak = max(r['peak_memory'] for r in records)
+    lines.append(f'Peak traced memory: {peak / 2 ** 20:.1f} MB')
+    return lines
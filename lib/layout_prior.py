@@ -0,0 +1,111 @@
+"""Reuse the grid lines of the previous page as a prior for the next page."""
+
+import numpy as np
+
+from lib.util import Offset
+
+
+def page_layout(grid):
+    """Get the lines found in a grid and its sub-grids on the page."""
+    if not grid.horiz.found or not grid.vert.found:
+        return None
+    return {
+        'horiz': shift_lines(grid.horiz.found, grid.offset),
+        'vert': shift_lines(grid.vert.found, grid.offset),
+        'bands': [page_layout(band) for band in grid.bands],
+    }
+
+
+def shift_lines(lines, offset):
+    """Move the lines by the offset."""
+    return [[[x + offset.x, y + offset.y] for x, y in line] for line in lines]
+
+
+def shift_layout(layout, offset):
+    """Move all of the lines in a layout by the offset."""
+    if not layout:
+        return None
+    return {
+        'horiz': shift_lines(layout['horiz'], offset),
+        'vert': shift_lines(layout['vert'], offset),
+        'bands': [shift_layout(band, offset) for band in layout['bands']],
+    }
+
+
+def best_shift(profile, previous, max_shift):
+    """Find the shift of the profile that best matches the previous one."""
+    profile = profile - profile.mean()
+    previous = previous - previous.mean()
+    size = min(len(profile), len(previous)) - max_shift
+    scores = [np.dot(profile[max_shift + s:size + s],
+                     previous[max_shift:size])
+              for s in range(-max_shift, max_shift + 1)]
+    return int(np.argmax(scores)) - max_shift
+
+
+class LayoutPrior:
+    """
+    The grid lines found on the previous page.
+
+    The next page is aligned to the previous one with the ink projection
+    profiles and the previous lines are moved to match. The grid line finders
+    then only search narrow bands around the expected lines.
+    """
+
+    enabled = False
+
+    # How far, in pixels, consecutive pages may be out of alignment
+    max_shift = 100
+
+    def __init__(self):
+        """Start with no previous page."""
+        self.profiles = None
+        self.layout = None
+
+    @staticmethod
+    def get_profiles(edges):
+        """Get the ink projection profiles of a page."""
+        return (edges.sum(axis=1, dtype=np.intp),
+                edges.sum(axis=0, dtype=np.intp))
+
+    def get(self, edges):
+        """
+        Get the previous page's layout aligned to this page.
+
+        Returns None if there is no usable previous page.
+        """
+        if not self.enabled or not self.layout:
+            return None
+        rows, cols = self.get_profiles(edges)
+        prev_rows, prev_cols = self.profiles
+        if min(len(rows), len(prev_rows), len(cols), len(prev_cols)) \
+                <= 2 * self.max_shift:
+            return None
+        offset = Offset(x=best_shift(cols, prev_cols, self.max_shift),
+                        y=best_shift(rows, prev_rows, self.max_shift))
+        return {
+            'left_side': shift_layout(self.layout['left_side'], offset),
+            'months': [shift_layout(m, offset)
+                       for m in self.layout['months']],
+        }
+
+    def remember(self, grid, left_side, months):
+        """Keep this page's layout for the next page."""
+        if not self.enabled:
+            return
+        left_layout = page_layout(left_side)
+        if not left_layout:
+            return
+        self.profiles = self.get_profiles(grid.edges)
+        self.layout = {
+            'left_side': left_layout,
+            'months': [page_layout(m) for m in months],
+        }
+
+
+PRIOR = LayoutPrior()
+
+
+def enable(enabled=True):
+    """Turn the layout prior on or off."""
+    LayoutPrior.enabled = enabled
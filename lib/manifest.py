@@ -0,0 +1,85 @@
+"""A manifest of the processed pages so that runs can be resumed."""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from lib.geometry_cache import parameters
+
+
+def content_hash(image):
+    """
+    Hash a page image.
+
+    Image files are hashed as they are stored, so unchanged pages are not
+    decoded.
+    """
+    digest = hashlib.sha256()
+    if isinstance(image, str):
+        with open(image, 'rb') as image_file:
+            for block in iter(lambda: image_file.read(2 ** 20), b''):
+                digest.update(block)
+    else:
+        digest.update(str((image.shape, image.dtype.str)).encode())
+        digest.update(np.ascontiguousarray(image).view(np.uint8))
+    return digest.hexdigest()
+
+
+def fingerprint():
+    """Hash the parameters that change a page's results."""
+    params = json.dumps(parameters(), sort_keys=True).encode()
+    return hashlib.sha256(params).hexdigest()
+
+
+class Manifest:
+    """
+    Remember the pages that have been processed.
+
+    Each entry has the page's content hash, the parameter fingerprint, and
+    where the page's CSV rows are. Entries are appended as each page is
+    finished so a crashed run loses at most the pages in flight. The last
+    entry for a page wins.
+    """
+
+    def __init__(self, path):
+        """Load the manifest if there is one."""
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as manifest_file:
+                for line in manifest_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.entries[entry['page']] = entry
+
+    def is_current(self, page_name, digest, params):
+        """Are the page's results still good."""
+        entry = self.entries.get(page_name)
+        return bool(entry) \
+            and entry['hash'] == digest \
+            and entry['params'] == params \
+            and os.path.exists(entry['output'])
+
+    def output(self, page_name):
+        """Get where the page's CSV rows are."""
+        return self.entries[page_name]['output']
+
+    def record(self, page_name, digest, params, output):
+        """Add a finished page to the manifest."""
+        entry = {'page': page_name, 'hash': digest, 'params': params,
+                 'output': output}
+        self.entries[page_name] = entry
+        with open(self.path, 'a') as manifest_file:
+            manifest_file.write(json.dumps(entry) + '\n')
+
+    def compact(self):
+        """Rewrite the manifest with only the latest entry for each page."""
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as manifest_file:
+            for entry in self.entries.values():
+                manifest_file.write(json.dumps(entry) + '\n')
+        os.replace(temp_path, self.path)
@@ -0,0 +1,172 @@
+"""A compact binary store of the observations with bulk exports."""
+
+import csv
+import os
+
+import numpy as np
+
+DAYS = 31
+
+# Every row of days packs into the same number of bytes
+ROW_BYTES = (DAYS + 7) // 8
+
+CSV_HEADER = ['file_name', 'chart_in_file', 'year', 'month', 'row_no',
+              'bird_species'] + list(range(1, DAYS + 1))
+
+# One fixed size index record per month grid. The page names have any
+# length, so they are kept in their own file and found by their offset.
+INDEX_DTYPE = np.dtype([
+    ('name_start', '<u8'),
+    ('name_length', '<u4'),
+    ('chart', '<u2'),
+    ('rows', '<u4'),
+    ('start', '<u8'),
+])
+
+
+def csv_row(page_name, chart, row_no, days):
+    """Get the CSV row for one row of a month grid."""
+    return [page_name, chart, '', '', row_no, ''] + [
+        1 if day else '' for day in days]
+
+
+class ObservationStore:
+    """
+    Bit-packed presence matrices for every month grid.
+
+    A month grid is a matrix with a row per bird and a column per day, packed
+    eight days to a byte, so every row takes the same few bytes. The rows are
+    appended to the data file and each page's UTF-8 name to the names file.
+    A fixed size record for each month grid, with where its page name is,
+    its chart number, row count, and first row, is appended to the index. The
+    files only grow, so they can be memory mapped while pages are still being
+    added. The index is appended last so it never points past the end of the
+    other files.
+    """
+
+    def __init__(self, directory):
+        """Keep the store in the directory."""
+        self.data_path = os.path.join(directory, 'observations.bin')
+        self.index_path = os.path.join(directory, 'observations.idx')
+        self.names_path = os.path.join(directory, 'observations.names')
+
+    def clear(self):
+        """Start a new, empty store."""
+        for path in (self.data_path, self.index_path, self.names_path):
+            open(path, 'wb').close()
+
+    def append(self, page_name, months):
+        """Add a page's month grids, as boolean day matrices, in bulk."""
+        if not months:
+            return
+
+        name = page_name.encode('utf-8')
+        rows = np.array([len(days) for days in months], dtype=np.uint64)
+        index = np.zeros(len(months), dtype=INDEX_DTYPE)
+        index['name_start'] = file_size(self.names_path)
+        index['name_length'] = len(name)
+        index['chart'] = np.arange(1, len(months) + 1)
+        index['rows'] = rows
+        index['start'] = self.row_count() + np.cumsum(rows) - rows
+
+        packed = [np.packbits(days, axis=1) for days in months]
+        with open(self.data_path, 'ab') as data_file:
+            for grid_rows in packed:
+                data_file.write(grid_rows.tobytes())
+        with open(self.names_path, 'ab') as names_file:
+            names_file.write(name)
+        with open(self.index_path, 'ab') as index_file:
+            index_file.write(index.tobytes())
+
+    def close(self):
+        """Every page is written as it is added so there is nothing to do."""
+
+    def row_count(self):
+        """Get the number of rows in the data file."""
+        return file_size(self.data_path) // ROW_BYTES
+
+    def index(self):
+        """Memory map the index."""
+        return load(self.index_path, INDEX_DTYPE)
+
+    def page_names(self, index):
+        """Get the page name of every month grid in the index."""
+        names = load(self.names_path, np.uint8)
+        return [bytes(names[start:start + length]).decode('utf-8')
+                for start, length in zip(index['name_start'].tolist(),
+                                         index['name_length'].tolist())]
+
+    def days(self):
+        """Get every row's days as a boolean matrix."""
+        packed = load(self.data_path, np.uint8).reshape(-1, ROW_BYTES)
+        return np.unpackbits(packed, axis=1, count=DAYS).astype(bool)
+
+    def columns(self):
+        """
+        Get the observations as columns.
+
+        There is a value in each column for every row of every month grid,
+        in the order they were added.
+        """
+        index = self.index()
+        rows = index['rows'].astype(np.intp)
+        firsts = np.repeat(np.cumsum(rows) - rows, rows)
+        return {
+            'file_name': np.repeat(
+                np.array(self.page_names(index), dtype=str), rows),
+            'chart_in_file': np.repeat(index['chart'], rows),
+            'row_no': np.arange(rows.sum()) - firsts + 1,
+            'days': self.days()[:rows.sum()],
+        }
+
+    def pages(self):
+        """Get each page's name and the day matrices of its month grids."""
+        index, days = self.index(), self.days()
+        starts = index['name_start']
+        bounds = np.flatnonzero(starts[1:] != starts[:-1]) + 1
+        for grids in np.split(index, bounds) if len(index) else []:
+            yield self.page_names(grids[:1])[0], [
+                days[start:start + rows]
+                for start, rows in zip(grids['start'].tolist(),
+                                       grids['rows'].tolist())]
+
+    def export_csv(self, csv_path):
+        """Write the observations in the CSV file layout."""
+        columns = self.columns()
+        with open(csv_path, 'w', newline='') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(CSV_HEADER)
+            writer.writerows(
+                csv_row(*row) for row in zip(
+                    columns['file_name'],
+                    columns['chart_in_file'].tolist(),
+                    columns['row_no'].tolist(),
+                    columns['days'].tolist()))
+
+    def export_columns(self, directory):
+        """
+        Write the observations as a directory of column files.
+
+        Each column is a .npy file, with a file for each day, so loaders can
+        memory map just the columns they need.
+        """
+        os.makedirs(directory, exist_ok=True)
+        columns = self.columns()
+        days = columns.pop('days')
+        for day in range(DAYS):
+            columns[f'day_{day + 1:02d}'] = days[:, day]
+        for name, values in columns.items():
+            np.save(os.path.join(directory, name + '.npy'),
+                    np.ascontiguousarray(values))
+
+
+def file_size(path):
+    """Get the size of a file. Missing files are empty."""
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def load(path, dtype):
+    """Memory map a file of fixed size records. Empty files are empty."""
+    if not os.path.exists(path) or not os.path.getsize(path):
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r')
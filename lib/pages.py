@@ -0,0 +1,48 @@
+"""Sources of journal pages as (page ID, image) pairs."""
+
+import os
+
+import numpy as np
+
+
+def page_id(path):
+    """Get the page ID from a file path."""
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def image_file_pages(file_names):
+    """
+    Get the pages from image files.
+
+    The image is given as the file name, so the file is read by whoever
+    processes the page.
+    """
+    for file_name in file_names:
+        yield page_id(file_name), file_name
+
+
+def pdf_pages(pdf_paths, dpi=300):
+    """
+    Stream the pages of the PDFs one grey scale image at a time.
+
+    The page ID is the PDF's name plus the 1-based page number, like the
+    exported page images. Nothing is written to disk.
+    """
+    # pylint: disable=import-outside-toplevel
+    try:
+        import pymupdf
+    except ImportError:
+        try:
+            import fitz as pymupdf
+        except ImportError as err:
+            raise ImportError(
+                'Reading PDFs requires PyMuPDF: pip install PyMuPDF') from err
+
+    for pdf_path in pdf_paths:
+        base_name = page_id(pdf_path)
+        with pymupdf.open(pdf_path) as pdf:
+            for page_no, page in enumerate(pdf, 1):
+                pixmap = page.get_pixmap(dpi=dpi, colorspace=pymupdf.csGRAY)
+                image = np.frombuffer(pixmap.samples, dtype=np.uint8)
+                image = image.reshape(pixmap.height, pixmap.stride)
+                yield f'{base_name}-{page_no:03d}', image[:, :pixmap.width]
@@ -0,0 +1,93 @@
+"""Overlap reading, analyzing, and writing pages with asyncio."""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+DONE = object()
+
+
+class Pipeline:
+    """
+    Run each page through the read, analyze, and write stages.
+
+    Pages are read and written in threads while earlier and later pages are
+    being analyzed. Pages move between the stages through bounded queues and
+    only a limited number of pages are in flight, so memory stays bounded
+    when one of the stages is slow. Pages are written in the input order.
+    """
+
+    def __init__(self, read, analyze, write, executor, workers=1, prefetch=2):
+        """
+        Set up the stages.
+
+        The executor runs analyze. It is a thread or process pool with the
+        given number of workers.
+        """
+        self.read = read
+        self.analyze = analyze
+        self.write = write
+        self.executor = executor
+        self.workers = workers
+        self.prefetch = prefetch
+
+    def run(self, pages):
+        """Process the pages and return the analysis results in order."""
+        return asyncio.run(self.run_async(pages))
+
+    async def run_async(self, pages):
+        """Process the pages and return the analysis results in order."""
+        loop = asyncio.get_running_loop()
+        in_flight = asyncio.Semaphore(2 * self.prefetch + self.workers)
+        read_queue = asyncio.Queue(self.prefetch)
+        write_queue = asyncio.Queue(self.prefetch)
+        pages = iter(pages)
+        results = []
+
+        with ThreadPoolExecutor(1) as reader, ThreadPoolExecutor(1) as writer:
+
+            async def read_pages():
+                idx = 0
+                while True:
+                    await in_flight.acquire()
+                    page = await loop.run_in_executor(
+                        reader, next, pages, DONE)
+                    if page is DONE:
+                        break
+                    page = await loop.run_in_executor(reader, self.read, page)
+                    await read_queue.put((idx, page))
+                    idx += 1
+                for _ in range(self.workers):
+                    await read_queue.put(DONE)
+
+            async def analyze_pages():
+                while True:
+                    item = await read_queue.get()
+                    if item is DONE:
+                        break
+                    idx, page = item
+                    result = await loop.run_in_executor(
+                        self.executor, self.analyze, page)
+                    await write_queue.put((idx, result))
+                await write_queue.put(DONE)
+
+            async def write_pages():
+                pending, next_idx, running = {}, 0, self.workers
+                while running:
+                    item = await write_queue.get()
+                    if item is DONE:
+                        running -= 1
+                        continue
+                    pending[item[0]] = item[1]
+                    while next_idx in pending:
+                        result = pending.pop(next_idx)
+                        await loop.run_in_executor(writer, self.write, result)
+                        results.append(result)
+                        in_flight.release()
+                        next_idx += 1
+
+            await asyncio.gather(
+                read_pages(),
+                write_pages(),
+                *[analyze_pages() for _ in range(self.workers)])
+
+        return results
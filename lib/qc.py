@@ -0,0 +1,142 @@
+"""Render the quality control image for a page."""
+
+import numpy as np
+from skimage import io
+
+from lib import instrument
+
+LABEL_COLOR = '#feb209'
+SLASH_COLOR = '#39ad48'
+
+
+def row_label_boxes(left_side):
+    """Get the boxes for the row labels."""
+    return [row.patches()[0] + (LABEL_COLOR,)
+            for row, label in zip(left_side.cells, left_side.row_labels)
+            if label]
+
+
+def col_label_boxes(month):
+    """Get the boxes for the column labels of a month."""
+    return [patch + (LABEL_COLOR,)
+            for patch, label in zip(month.header_row.patches(),
+                                    month.col_labels)
+            if label]
+
+
+def slash_boxes(month):
+    """Get the boxes for the cells with slashes in a month."""
+    boxes = []
+    for row_idx, cell_row in enumerate(month.cells[1:]):
+        for col, patch in enumerate(cell_row.patches()):
+            if month.col_labels[col] and month.slashes[row_idx, col]:
+                boxes.append(patch + (SLASH_COLOR,))
+    return boxes
+
+
+def suspicious(months):
+    """Get the reasons that the page's results look wrong."""
+    reasons = []
+    if not months:
+        reasons.append('no month grids found')
+    for month_idx, month in enumerate(months, 1):
+        days = sum(month.col_labels)
+        if days < 31:
+            reasons.append(f'month {month_idx} has {days} day columns')
+        for band in month.stitched:
+            reasons.append(
+                f'month {month_idx} band {band + 1} has stitched columns')
+        if len({len(row) for row in month.cells}) > 1:
+            reasons.append(f'month {month_idx} has ragged rows')
+    return reasons
+
+
+def hex2rgb(color):
+    """Convert a hex color string to RGB values."""
+    return np.array([int(color[i:i + 2], 16) for i in (1, 3, 5)])
+
+
+def to_rgb(image, scale=1.0):
+    """Get a down-scaled 8-bit RGB copy of the page image."""
+    if scale != 1.0:
+        rows = (np.arange(int(image.shape[0] * scale)) / scale).astype(int)
+        cols = (np.arange(int(image.shape[1] * scale)) / scale).astype(int)
+        image = image[rows][:, cols]
+
+    if image.dtype == bool:
+        image = image.astype(np.uint8) * 255
+    elif image.dtype != np.uint8:
+        image = (image / image.max() * 255).astype(np.uint8)
+
+    if image.ndim == 2:
+        image = np.repeat(image[..., np.newaxis], 3, axis=2)
+
+    return np.ascontiguousarray(image[..., :3])
+
+
+def blend_boxes(rgb, boxes, scale=1.0, alpha=0.5):
+    """Alpha blend the colored boxes into the RGB image in place."""
+    for (left, top), width, height, color in boxes:
+        y0, y1 = int(top * scale), int((top + height) * scale)
+        x0, x1 = int(left * scale), int((left + width) * scale)
+        box = rgb[max(0, y0):max(0, y1), max(0, x0):max(0, x1)]
+        box[...] = box * (1.0 - alpha) + hex2rgb(color) * alpha
+
+
+class QCImage:
+    """
+    The quality control image for a page.
+
+    Row and column labels are colored gold and cells with slashes green. The
+    image is drawn straight into a copy of the page unless the matplotlib
+    renderer is selected.
+    """
+
+    # Render 'all', 'suspicious', or 'none' of the pages
+    mode = 'all'
+    scale = 1.0
+    renderer = 'numpy'
+
+    def __init__(self, grid, left_side, months):
+        """Collect the boxes to draw on the page."""
+        self.image = grid.image
+        self.boxes = row_label_boxes(left_side)
+        for month in months:
+            self.boxes += col_label_boxes(month)
+            self.boxes += slash_boxes(month)
+        self.reasons = suspicious(months)
+
+    @property
+    def wanted(self):
+        """Should this page's QC image be rendered."""
+        if self.mode == 'suspicious':
+            return bool(self.reasons)
+        return self.mode == 'all'
+
+    def save(self, img_path):
+        """Render the image and save it."""
+        if self.renderer == 'matplotlib':
+            self.save_figure(img_path)
+        else:
+            rgb = to_rgb(self.image, self.scale)
+            blend_boxes(rgb, self.boxes, self.scale)
+            with instrument.stage('encode_png'):
+                io.imsave(img_path, rgb, check_contrast=False)
+
+    def save_figure(self, img_path):
+        """Render the image as a matplotlib figure and save it."""
+        # pylint: disable=import-outside-toplevel
+        import matplotlib.pyplot as plt
+        from matplotlib import patches
+
+        fig, ax = plt.subplots(figsize=(10, 15.45), frameon=False)
+        ax.imshow(self.image, cmap=plt.cm.gray)
+        ax.axis('off')
+
+        for top_left, width, height, color in self.boxes:
+            ax.add_patch(patches.Rectangle(
+                top_left, width, height, alpha=0.5, facecolor=color))
+
+        with instrument.stage('savefig'):
+            fig.savefig(img_path, dpi=300 * self.scale, bbox_inches='tight')
+        plt.close(fig)
@@ -0,0 +1,138 @@
+"""Render synthetic journal pages for benchmarking."""
+
+# pylint: disable=too-many-arguments, too-many-locals, invalid-name
+
+import numpy as np
+from skimage.draw import line
+from skimage.transform import rescale, rotate
+
+# Layout of a page at the bundled scan's resolution, in pixels
+PAGE_WIDTH = 3300
+PAGE_HEIGHT = 5100
+CELL_WIDTH = 48
+CELL_HEIGHT = 47
+TOP_MARGIN = 150
+LEFT_MARGIN = 300
+RIGHT_MARGIN = 40
+LABEL_LINE = 500
+MONTH_LEFT = 1500
+MONTH_GAP = 3
+DAYS = 31
+
+
+def draw_line(page, start, end, thickness=3, gap=0, dash=8):
+    """Draw a thick ink line on the page. It is dashed if there is a gap."""
+    height, width = page.shape
+    for offset in range(thickness):
+        rr, cc = line(start[1] + offset, start[0], end[1] + offset, end[0])
+        keep = (rr >= 0) & (rr < height) & (cc >= 0) & (cc < width)
+        if gap:
+            keep &= np.arange(len(rr)) % (dash + gap) < dash
+        page[rr[keep], cc[keep]] = False
+
+
+def draw_slash(page, rng, left, top, gap=0):
+    """Draw a forward slash in the cell with the given top left corner."""
+    jitter = rng.integers(-3, 4, size=2)
+    draw_line(page,
+              (left + 12 + jitter[0], top + CELL_HEIGHT - 10),
+              (left + CELL_WIDTH - 12 + jitter[1], top + 10),
+              gap=gap)
+
+
+def draw_label(page, rng, left, top, width=CELL_WIDTH):
+    """Draw upright strokes that look like writing in the given cell."""
+    for x in range(left + 10, left + width - 10, 14):
+        lean = rng.integers(-4, 5)
+        draw_line(page, (x, top + 10), (x + lean, top + CELL_HEIGHT - 10),
+                  thickness=2)
+
+
+def page_rows(months, rows, ruled=True):
+    """
+    Get the row layout of the page.
+
+    Each month has a header row followed by its labeled rows. Months are
+    separated by blank rows so the label heuristics keep them apart. Like the
+    graph paper, the rest of the page is ruled with blank rows, unless the
+    ruling stops after the last month.
+    """
+    layout = []
+    for month in range(months):
+        layout += ['blank'] * (MONTH_GAP if month else 1)
+        layout.append('header')
+        layout += [('row', month, r) for r in range(rows)]
+    ruled_rows = (PAGE_HEIGHT - 2 * TOP_MARGIN) // CELL_HEIGHT
+    extra = ruled_rows - len(layout) if ruled else 0
+    layout += ['blank'] * max(2, extra)
+    return layout
+
+
+def render_page(months=3, rows=28, density=0.3, skew=0.0, scale=1.0,
+                seed=0, broken=0.0, ruled=True):
+    """
+    Render a synthetic ruled journal page.
+
+    The page is a bilevel image like the scans, with row labels on the left,
+    and a grid with column headers and slashes for every month on the right.
+    The broken fraction of the empty cells get slashes broken into dashes
+    with 4 pixel gaps, which are too broken to count as slashes. Unless the
+    page is ruled, the ruling stops after the last month. Returns the page
+    and the slashes for each month as a list of boolean matrices.
+    """
+    rng = np.random.default_rng(seed)
+    layout = page_rows(months, rows, ruled)
+    height = max(PAGE_HEIGHT, TOP_MARGIN * 2 + len(layout) * CELL_HEIGHT)
+    page = np.ones((height, PAGE_WIDTH), dtype=bool)
+
+    right = PAGE_WIDTH - RIGHT_MARGIN
+    bottom = TOP_MARGIN + len(layout) * CELL_HEIGHT
+    day_lines = [MONTH_LEFT + d * CELL_WIDTH for d in range(DAYS + 1)]
+
+    for r in range(len(layout) + 1):
+        y = TOP_MARGIN + r * CELL_HEIGHT
+        draw_line(page, (LEFT_MARGIN, y), (right, y))
+
+    draw_line(page, (LABEL_LINE, TOP_MARGIN), (LABEL_LINE, bottom))
+
+    slashes = [np.zeros((rows, DAYS), dtype=bool) for _ in range(months)]
+    month_top = None
+    for r, kind in enumerate(layout):
+        top = TOP_MARGIN + r * CELL_HEIGHT
+
+        if kind == 'header':
+            month_top = top
+            for x in day_lines[:-1]:
+                draw_label(page, rng, x, top)
+            continue
+
+        if kind == 'blank':
+            if month_top is not None:
+                for x in day_lines:
+                    draw_line(page, (x, month_top), (x, top))
+                month_top = None
+            continue
+
+        _, month, row = kind
+        draw_label(page, rng, LABEL_LINE - 80, top, width=80)
+        draw_label(page, rng, LABEL_LINE + 40, top, width=400)
+
+        marks = rng.random(DAYS) < density
+        marks[0] |= row == 0
+        slashes[month][row] = marks
+        for day in np.flatnonzero(marks):
+            draw_slash(page, rng, day_lines[day], top)
+        if broken:
+            dashed = ~marks & (rng.random(DAYS) < broken)
+            for day in np.flatnonzero(dashed):
+                draw_slash(page, rng, day_lines[day], top, gap=4)
+
+    if skew:
+        page = rotate(page, skew, resize=False, order=0, cval=1,
+                      preserve_range=True).astype(bool)
+
+    if scale != 1.0:
+        page = rescale(page, scale, order=0, preserve_range=True,
+                       anti_aliasing=False).astype(bool)
+
+    return page, slashes
@@ -0,0 +1,71 @@
+"""An opt-in thread pool for the independent work within a page."""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Threads:
+    """
+    The thread pool shared by the whole process.
+
+    The work is done in the calling thread until the pool is enabled. Work
+    that is started from inside a pool thread is also done in that thread,
+    so nested fan outs cannot wait on each other.
+    """
+
+    count = 1
+    executor = None
+    local = threading.local()
+
+    @classmethod
+    def enable(cls, count):
+        """Start, or stop, the thread pool."""
+        if cls.executor:
+            cls.executor.shutdown()
+        cls.count = count
+        cls.executor = ThreadPoolExecutor(count) if count > 1 else None
+
+    @classmethod
+    def in_pool(cls):
+        """Are we running in one of the pool's threads."""
+        return getattr(cls.local, 'in_pool', False)
+
+    @classmethod
+    def call(cls, func, item):
+        """Call the function and mark the thread as a pool thread."""
+        cls.local.in_pool = True
+        try:
+            return func(item)
+        finally:
+            cls.local.in_pool = False
+
+
+def enable(count):
+    """Use this many threads within a page."""
+    Threads.enable(count)
+
+
+def map_ordered(func, items):
+    """
+    Call the function on every item, in parallel if we can.
+
+    The results are in the same order as the items.
+    """
+    items = list(items)
+    if not Threads.executor or len(items) < 2 or Threads.in_pool():
+        return [func(item) for item in items]
+    return list(Threads.executor.map(Threads.call, [func] * len(items), items))
+
+
+def map_chunks(func, items):
+    """
+    Call the function on every item with a chunk of the items per thread.
+
+    Small pieces of work, like classifying a cell, are not worth a task each.
+    The results are in the same order as the items.
+    """
+    items = list(items)
+    size = max(1, -(-len(items) // Threads.count))
+    chunks = [items[i:i + size] for i in range(0, len(items), size)]
+    results = map_ordered(lambda chunk: [func(item) for item in chunk], chunks)
+    return [result for chunk in results for result in chunk]
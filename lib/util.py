@@ -10,6 +10,13 @@ import numpy as np
 Crop = namedtuple('Crop', 'top bottom left right')
 Offset = namedtuple('Offset', 'x y')
 Point = namedtuple('Point', 'x y')
+PageResult = namedtuple('PageResult', 'name months qc record')
+Arrival = namedtuple('Arrival', 'name path time reply')
+
+
+def tile_rows(width, tile_bytes, bytes_per_pixel=32):
+    """Get how many rows of an image fit in a tile of the given size."""
+    return max(1, tile_bytes // (width * bytes_per_pixel))
 
 
 def intersection(line1, line2):
@@ -50,3 +57,48 @@ def too_close(line1, line2, threshold=40):
     dist2 = np.sqrt((p2[0] - p4[0]) ** 2 + (p2[1] - p4[1]) ** 2)
 
     return min(dist1, dist2) < threshold
+
+
+def intersections(lines1, lines2):
+    """
+    Find the intersection of every line in lines1 with every line in lines2.
+
+    The lines are arrays of end points. We return the x and y arrays indexed
+    by [line1, line2]. The arithmetic is the same as intersection() so the
+    points are identical.
+    """
+    lines1 = np.asarray(lines1).reshape(-1, 2, 2)
+    lines2 = np.asarray(lines2).reshape(-1, 2, 2)
+    x1, y1, x2, y2 = [lines1[:, i, j, np.newaxis]
+                      for i, j in ((0, 0), (0, 1), (1, 0), (1, 1))]
+    x3, y3, x4, y4 = [lines2[np.newaxis, :, i, j]
+                      for i, j in ((0, 0), (0, 1), (1, 0), (1, 1))]
+    denominator = (x1 - x2) * (y3 - y4) - (y1 - y2) * (x3 - x4)
+    num1 = x1 * y2 - y1 * x2
+    num2 = x3 * y4 - y3 * x4
+    px = (num1 * (x3 - x4) - (x1 - x2) * num2) / denominator
+    py = (num1 * (y3 - y4) - (y1 - y2) * num2) / denominator
+    return np.trunc(px).astype(int), np.trunc(py).astype(int)
+
+
+def extend_lines(lines, length):
+    """Extend every line past its second end point like extend_line()."""
+    lines = np.asarray(lines).reshape(-1, 2, 2)
+    p1, p2 = lines[:, 0], lines[:, 1]
+
+    line_len = np.sqrt(((p1 - p2) ** 2).sum(axis=1))
+    p3 = p2 + (p2 - p1) / line_len[:, np.newaxis] * length
+    return np.stack([p1, np.trunc(p3).astype(int)], axis=1)
+
+
+def close_neighbors(lines, threshold=40):
+    """
+    Find the sorted lines that are too close to the line before them.
+
+    This is too_close() for every pair of neighboring lines. The first line
+    is never too close.
+    """
+    lines = np.asarray(lines).reshape(-1, 2, 2)
+    dists = np.sqrt(((lines[:-1] - lines[1:]) ** 2).sum(axis=2))
+    close = dists.min(axis=1) < threshold
+    return np.concatenate([[False], close])[:len(lines)]
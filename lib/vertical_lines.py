@@ -1,5 +1,7 @@
 """Contains logic that is unique to the vertical grid lines."""
 
+import numpy as np
+
 from lib.grid_lines import GridLines
 
 
@@ -11,7 +13,31 @@ class Vertical(GridLines):
         super().__init__(image)
         self.size = image.shape[0]
         self.thetas = self.near_vert
-        self.threshold = self.size * 0.4
+        self.threshold = self.size_threshold()
+
+    def strip_profiles(self):
+        """Vertical lines run along the y-axis."""
+        starts = np.arange(0, self.size, self.strip_size)
+        return np.add.reduceat(self.image, starts, axis=0, dtype=np.intp)
+
+    def ink_coords(self, low, high, stride=1):
+        """Vertical lines run along the y-axis."""
+        y, x = np.nonzero(self.image[::stride, low:high])
+        return x + low, y * stride
+
+    def shear2polar(self, shear, offset):
+        """Convert the line x = offset + y * tan(shear) to polar form."""
+        return -shear, offset * np.cos(shear)
+
+    def polar2shear(self, theta, rho):
+        """Convert a polar line to the form x = offset + y * tan(shear)."""
+        return -theta, rho / np.cos(theta)
+
+    def line2shear(self, line):
+        """Convert a line to the form x = offset + y * tan(shear)."""
+        (x0, y0), (x1, y1) = line
+        shear = np.arctan2(x1 - x0, y1 - y0)
+        return shear, x0 - y0 * np.tan(shear)
 
     def insert_line(self, from_this_line, distance=-50):
         """Insert a vertical grid line relative to another line."""
@@ -0,0 +1,348 @@
+"""Check the pipeline's results and speed against golden pages."""
+
+# pylint: disable=invalid-name
+
+import argparse
+import copy
+import csv
+import glob
+import json
+import os
+import shlex
+import statistics
+import sys
+import tempfile
+from time import perf_counter
+
+import numpy as np
+from skimage import io
+
+from boyd_journal_extraction import (
+    analyze_page, configure, parse_args as pipeline_args, read_page)
+from lib import instrument, layout_prior
+from lib.horizontal_lines import Horizontal
+from lib.observations import DAYS
+from lib.pages import page_id
+from lib.synthetic import render_page
+from lib.util import (
+    close_neighbors, extend_line, extend_lines, intersection, intersections,
+    too_close)
+from lib.vertical_lines import Vertical
+
+ASSETS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets')
+
+
+def read_golden(csv_path):
+    """Read a golden CSV file into each page's days keyed by (chart, row)."""
+    pages = {}
+    with open(csv_path, newline='') as csv_file:
+        reader = csv.reader(csv_file)
+        next(reader)
+        for row in reader:
+            days = np.array([cell == '1' for cell in row[6:6 + DAYS]])
+            pages.setdefault(row[0], {})[int(row[1]), int(row[4])] = days
+    return pages
+
+
+def golden_days(months):
+    """Key the day matrices of a page's month grids by (chart, row)."""
+    return {(chart, row_no): days
+            for chart, matrix in enumerate(months, 1)
+            for row_no, days in enumerate(matrix, 1)}
+
+
+def score(golden, found):
+    """Count the marks that were found, missed, or made up."""
+    blank = np.zeros(DAYS, dtype=bool)
+    counts = {'true_pos': 0, 'false_pos': 0, 'false_neg': 0}
+    for key in golden.keys() | found.keys():
+        want, got = golden.get(key, blank), found.get(key, blank)
+        counts['true_pos'] += int(np.count_nonzero(want & got))
+        counts['false_pos'] += int(np.count_nonzero(got & ~want))
+        counts['false_neg'] += int(np.count_nonzero(want & ~got))
+    counts['missing_rows'] = len(golden.keys() - found.keys())
+    counts['extra_rows'] = len(found.keys() - golden.keys())
+    return counts
+
+
+def precision_recall(counts):
+    """Get the precision and recall of the marks."""
+    true_pos = counts['true_pos']
+    found = true_pos + counts['false_pos']
+    wanted = true_pos + counts['false_neg']
+    return (true_pos / found if found else 1.0,
+            true_pos / wanted if wanted else 1.0)
+
+
+def corpus_pages(directories, use_asset=True):
+    """
+    Get the pages with golden CSV files.
+
+    A corpus directory has page images with golden CSV files of the same
+    name. Yields the image file names and the page's golden days.
+    """
+    if use_asset:
+        directories = [ASSETS] + list(directories)
+    for directory in directories:
+        for csv_path in sorted(glob.glob(os.path.join(directory, '*.csv'))):
+            file_name = os.path.splitext(csv_path)[0] + '.png'
+            if not os.path.exists(file_name):
+                continue
+            golden = read_golden(csv_path)
+            yield file_name, golden.get(page_id(file_name), {})
+
+
+def synthetic_pages(args, out_dir):
+    """
+    Render the synthetic pages and get their true days.
+
+    There is a page for every seed and skew, and a page for every seed with
+    broken slashes that must not be found. There is also a pair of pages for
+    every seed where the first page has half the rows and no ruling below
+    them, so the first page's layout prior must not be used for the second.
+    """
+    months, rows = args.months, args.rows
+    pages = [(f'synthetic_{months}_{skew}_{seed}', rows, skew, seed, 0.0,
+              True) for seed in range(args.synthetic) for skew in args.skews]
+    if args.broken:
+        pages += [(f'synthetic_{months}_broken_{seed}', rows, 0.0, seed,
+                   args.broken, True) for seed in range(args.synthetic)]
+    for seed in range(args.synthetic):
+        pages += [
+            (f'synthetic_{months}_short_{seed}', rows // 2, 0.0, seed, 0.0,
+             False),
+            (f'synthetic_{months}_tall_{seed}', rows, 0.0, seed, 0.0, True)]
+
+    for name, page_rows, skew, seed, broken, ruled in pages:
+        page, slashes = render_page(months=months, rows=page_rows, skew=skew,
+                                    seed=seed, broken=broken, ruled=ruled)
+        file_name = os.path.join(out_dir, name + '.png')
+        io.imsave(file_name, page.astype(np.uint8) * 255,
+                  check_contrast=False)
+        yield file_name, golden_days(slashes)
+
+
+def run_page(file_name, golden, args):
+    """
+    Run the pipeline on a page and check it.
+
+    The page is timed without the instrumentation and then run once more
+    with it to get the peak memory. Every run starts from the layout prior
+    of the page before, like a real run, and not from this page's layout.
+    """
+    name = page_id(file_name)
+    result = {'page': name}
+    times = []
+    prior = copy.copy(layout_prior.PRIOR)
+    try:
+        for _ in range(args.repeat):
+            layout_prior.PRIOR = copy.copy(prior)
+            instrument.enable(False)
+            start = perf_counter()
+            page = analyze_page(read_page((name, file_name)))
+            times.append(perf_counter() - start)
+
+        layout_prior.PRIOR = copy.copy(prior)
+        instrument.enable(True)
+        record = analyze_page(read_page((name, file_name))).record
+    except Exception as err:  # pylint: disable=broad-except
+        result['error'] = f'{type(err).__name__}: {err}'
+        return result
+
+    result.update(score(golden, golden_days(page.months)))
+    result['precision'], result['recall'] = precision_recall(result)
+    result['time'] = statistics.median(times)
+    result['peak_memory'] = record['peak_memory'] / 2 ** 20
+    return result
+
+
+def geometry_mismatches(count, seed=0):
+    """
+    Compare the batched line geometry with the scalar functions.
+
+    The lines are random near horizontal and near vertical grid lines on a
+    page sized image. Every batched function must give exactly the same
+    points as its scalar function. Returns the number of differing results
+    for each batched function.
+    """
+    rng = np.random.default_rng(seed)
+    image = np.zeros((3300, 5100), dtype=bool)
+    mismatches = {}
+
+    def check(name, batched, scalar):
+        differ = np.asarray(batched) != np.asarray(scalar)
+        differ = differ.reshape(len(differ), -1).any(axis=1)
+        mismatches[name] = mismatches.get(name, 0) + int(differ.sum())
+
+    lines = []
+    for finder in (Horizontal(image), Vertical(image)):
+        thetas = rng.uniform(finder.thetas.min(), finder.thetas.max(), count)
+        thetas[:len(finder.thetas)] = finder.thetas[:count]
+        rhos = rng.uniform(0, image.size / finder.size, count)
+        found = finder.endpoints(thetas, rhos)
+        check('endpoints', found, [
+            finder.polar2endpoints(theta, rho)
+            for theta, rho in zip(thetas, rhos)])
+
+        found = sorted(found.tolist(), key=finder.sort_key)
+        check('close_neighbors', close_neighbors(found), [False] + [
+            too_close(line1, line2) for line1, line2 in zip(found, found[1:])])
+        check('extend_lines', extend_lines(found, finder.size), [
+            extend_line(line, finder.size) for line in found])
+        lines.append(found)
+
+    horiz, vert = lines
+    check('intersections', np.stack(intersections(horiz, vert), axis=-1), [
+        [intersection(line1, line2) for line2 in vert] for line1 in horiz])
+    return mismatches
+
+
+def failures(result, args):
+    """Get the budgets that the page went over."""
+    if 'error' in result:
+        return [result['error']]
+    reasons = []
+    if result['precision'] < args.min_precision:
+        reasons.append(f"precision {result['precision']:.4f}")
+    if result['recall'] < args.min_recall:
+        reasons.append(f"recall {result['recall']:.4f}")
+    if result['time'] > args.time_budget:
+        reasons.append(f"time {result['time']:.2f}s")
+    if result['peak_memory'] > args.memory_budget:
+        reasons.append(f"memory {result['peak_memory']:.0f} MB")
+    return reasons
+
+
+def print_result(result):
+    """Print a one line summary of a page's check."""
+    if 'error' in result:
+        status = 'FAIL'
+        details = ''
+    else:
+        status = 'FAIL' if result['failures'] else 'ok'
+        details = (f"precision {result['precision']:.4f} "
+                   f"recall {result['recall']:.4f} "
+                   f"time {result['time']:6.2f}s "
+                   f"memory {result['peak_memory']:6.1f} MB")
+    print(f"{status:4}  {result['page']:40} {details}")
+    if result['failures']:
+        print(f"      {'; '.join(result['failures'])}")
+
+
+def run_regression(args):
+    """Check every page and return the results."""
+    configure(pipeline_args(args.options + ['--qc', 'none']))
+
+    results = []
+    with tempfile.TemporaryDirectory() as out_dir:
+        pages = list(corpus_pages(args.corpus, not args.no_asset))
+        pages += synthetic_pages(args, out_dir)
+        for file_name, golden in pages:
+            result = run_page(file_name, golden, args)
+            result['failures'] = failures(result, args)
+            results.append(result)
+
+    totals = {key: sum(r.get(key, 0) for r in results)
+              for key in ('true_pos', 'false_pos', 'false_neg')}
+    precision, recall = precision_recall(totals)
+    return {
+        'options': shlex.join(args.options),
+        'precision': precision,
+        'recall': recall,
+        'failed': sum(1 for r in results if r['failures']),
+        'results': results,
+        'geometry': geometry_mismatches(args.geometry_lines)
+        if args.geometry_lines else {},
+    }
+
+
+def parse_args():
+    """Process command-line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        'corpus', nargs='*',
+        help="""Directories of page images with golden CSV files of the same
+            name. The bundled page is always checked unless --no-asset.""")
+    parser.add_argument(
+        '--options', nargs=argparse.REMAINDER, default=[],
+        help="""Options for boyd_journal_extraction.py to check. Everything
+            after --options is passed on, so it must come last. For example:
+            --options --line-engine coarse --layout-prior.""")
+    parser.add_argument(
+        '--no-asset', action='store_true',
+        help="""Skip the bundled journal page.""")
+    parser.add_argument(
+        '--synthetic', type=int, default=2,
+        help="""Also check this many synthetic pages for each skew. Their
+            golden results are the slashes that were drawn.
+            (default: %(default)s)""")
+    parser.add_argument(
+        '--skews', type=float, nargs='*', default=[0.0, 0.3],
+        help="""Synthetic page skew angles in degrees.
+            (default: %(default)s)""")
+    parser.add_argument(
+        '--broken', type=float, default=0.3,
+        help="""The fraction of the empty cells with broken slashes on the
+            extra synthetic page for each seed. 0 skips those pages.
+            (default: %(default)s)""")
+    parser.add_argument(
+        '--months', type=int, default=3,
+        help="""Months on each synthetic page. (default: %(default)s)""")
+    parser.add_argument(
+        '--rows', type=int, default=28,
+        help="""Rows per month on the synthetic pages.
+            (default: %(default)s)""")
+    parser.add_argument(
+        '--geometry-lines', type=int, default=200,
+        help="""Check the batched line geometry against the scalar functions
+            with this many random lines in each direction. 0 skips the check.
+            (default: %(default)s)""")
+    parser.add_argument(
+        '--min-precision', type=float, default=1.0,
+        help="""Fail pages with a lower precision. (default: %(default)s)""")
+    parser.add_argument(
+        '--min-recall', type=float, default=1.0,
+        help="""Fail pages with a lower recall. (default: %(default)s)""")
+    parser.add_argument(
+        '--time-budget', type=float, default=10.0,
+        help="""Fail pages that take longer than this many seconds.
+            (default: %(default)s)""")
+    parser.add_argument(
+        '--memory-budget', type=float, default=512.0,
+        help="""Fail pages with a higher peak traced memory in MB.
+            (default: %(default)s)""")
+    parser.add_argument(
+        '--repeat', type=int, default=1,
+        help="""Time each page this many times and keep the median.
+            (default: %(default)s)""")
+    parser.add_argument(
+        '--json',
+        help="""Also write the results to this JSON file.""")
+    args = parser.parse_args()
+    args.options = [word for option in args.options
+                    for word in shlex.split(option)]
+    return args
+
+
+if __name__ == '__main__':
+    ARGS = parse_args()
+    RESULTS = run_regression(ARGS)
+    for RESULT in RESULTS['results']:
+        print_result(RESULT)
+    GEOMETRY_FAILED = {name: count for name, count in
+                       RESULTS['geometry'].items() if count}
+    if RESULTS['geometry']:
+        print(f"{'FAIL' if GEOMETRY_FAILED else 'ok':4}  "
+              f"{'batched line geometry':40} "
+              f"{ARGS.geometry_lines} lines in each direction")
+    if GEOMETRY_FAILED:
+        print('      ' + '; '.join(
+            f'{name} {count} differ' for name, count in
+            GEOMETRY_FAILED.items()))
+    print(f"Overall precision {RESULTS['precision']:.4f} "
+          f"recall {RESULTS['recall']:.4f}, "
+          f"{RESULTS['failed']} of {len(RESULTS['results'])} pages failed")
+    if ARGS.json:
+        with open(ARGS.json, 'w') as json_file:
+            json.dump(RESULTS, json_file, indent=2)
+    sys.exit(1 if RESULTS['failed'] or GEOMETRY_FAILED else 0)